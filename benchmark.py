@@ -0,0 +1,405 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from c4bot import c4board
+from c4bot import c4types
+from c4bot.agent.mcts import MCTSAgent
+from c4bot.agent.zero import ZeroAgent, ZeroEncoder
+from c4bot.playout import ROLLOUT_POLICIES
+from c4bot.rollout import batch_rollouts
+
+# Every benchmark prints its results and returns them as a dict. Metrics
+# ending in '/s' are rates, those ending in 'seconds' are times and those
+# ending in 'score' are match results. Rates and times may drift by a
+# relative tolerance, scores by an absolute one, since a score can be 0.
+# All others are counts that have to match the baseline exactly.
+
+class StubModel():
+    """Stands in for the Keras model: fixed random linear policy and value heads."""
+    def __init__(self, input_shape, seed=1):
+        rng = np.random.RandomState(seed)
+        size = int(np.prod(input_shape))
+        self.policy_weights = rng.normal(scale=0.1, size=(size, 7)).astype(np.float32)
+        self.value_weights = rng.normal(scale=0.1, size=(size, 1)).astype(np.float32)
+
+    def predict(self, model_input, batch_size=None):
+        flat = model_input.reshape(len(model_input), -1)
+        logits = flat @ self.policy_weights
+        priors = np.exp(logits - logits.max(axis=1, keepdims=True))
+        priors /= priors.sum(axis=1, keepdims=True)
+        return priors, np.tanh(flat @ self.value_weights)
+
+def timed(duration, step):
+    """Calls step until duration has passed; returns the summed counts and seconds."""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        count += step()
+    return count, time.perf_counter() - start
+
+def perft(game, depth):
+    if depth == 0 or game.is_over():
+        return 1, 1
+    leaves = 0
+    nodes = 1
+    for move in game.legal_moves():
+        child_leaves, child_nodes = perft(game.apply_move(move), depth - 1)
+        leaves += child_leaves
+        nodes += child_nodes
+    return leaves, nodes
+
+def bench_perft(duration, depth=6):
+    root = c4board.GameState.new_game()
+    leaves, nodes = perft(root, depth)
+    num_nodes, elapsed = timed(duration, lambda: perft(root, depth)[1])
+    print('perft({}): {} leaves, {:.0f} nodes/s'.format(depth, leaves, num_nodes / elapsed))
+    return {
+        'perft({}) leaves'.format(depth): leaves,
+        'perft({}) nodes/s'.format(depth): num_nodes / elapsed,
+    }
+
+def bench_moves(duration):
+    def play_game():
+        game = c4board.GameState.new_game()
+        num_moves = 0
+        while not game.is_over():
+            game = game.apply_move(random.choice(game.legal_moves()))
+            num_moves += 1
+        return num_moves
+    num_moves, elapsed = timed(duration, play_game)
+    print('moves: {:.0f} moves/s'.format(num_moves / elapsed))
+    return {'moves/s': num_moves / elapsed}
+
+def bench_rollouts(duration):
+    root = c4board.GameState.new_game()
+    results = {}
+    for name, policy in ROLLOUT_POLICIES.items():
+        def rollout():
+            policy(root)
+            return 1
+        num_rollouts, elapsed = timed(duration, rollout)
+        print('rollouts ({}): {:.0f} rollouts/s'.format(name, num_rollouts / elapsed))
+        # the uniform rate keeps the name it had before there were policies
+        key = 'rollouts/s' if name == 'uniform' else '{} rollouts/s'.format(name)
+        results[key] = num_rollouts / elapsed
+    return results
+
+def bench_rollout_policy(duration, move_time=0.02, policy='tactical', baseline='uniform'):
+    """Score of MCTS with policy against MCTS with baseline at equal time per move.
+
+    Both agents search until move_time runs out, so the score shows whether
+    better rollouts are worth their extra CPU time. Colours alternate and
+    both games of a pair start from the same random two-ply opening.
+    """
+    bots = {
+        name: MCTSAgent(1000000, 1.5, time_budget=move_time, rollout_policy=ROLLOUT_POLICIES[name])
+        for name in (policy, baseline)
+    }
+    score = 0.0
+    num_games = 0
+    start = time.perf_counter()
+    # an even number of games, at least one pair
+    while num_games < 2 or num_games % 2 == 1 or time.perf_counter() - start < duration:
+        rng = random.Random(num_games // 2)
+        players = {c4types.Player.red: policy, c4types.Player.yellow: baseline}
+        if num_games % 2 == 1:
+            players = {player.other: name for player, name in players.items()}
+        game = c4board.GameState.new_game()
+        for _ in range(2):
+            game = game.apply_move(rng.choice(game.legal_moves()))
+        while not game.is_over():
+            game = game.apply_move(bots[players[game.next_player]].select_move(game))
+        winner = game.winner()
+        if winner is None:
+            score += 0.5
+        elif players[winner] == policy:
+            score += 1
+        num_games += 1
+    print('{} vs {} at {:.0f} ms/move: {:.1%} over {} games'.format(
+        policy, baseline, move_time * 1000, score / num_games, num_games))
+    return {'{} vs {} score'.format(policy, baseline): score / num_games}
+
+def bench_batch_rollouts(duration, batch_size=256):
+    root = c4board.GameState.new_game()
+    def rollouts():
+        batch_rollouts(root, batch_size)
+        return batch_size
+    num_rollouts, elapsed = timed(duration, rollouts)
+    print('batch rollouts ({}): {:.0f} rollouts/s'.format(batch_size, num_rollouts / elapsed))
+    return {'batch rollouts ({}) rollouts/s'.format(batch_size): num_rollouts / elapsed}
+
+def bench_mcts(duration, num_rounds=2000):
+    root = c4board.GameState.new_game()
+    results = {}
+    for name, policy in ROLLOUT_POLICIES.items():
+        bot = MCTSAgent(num_rounds, 1.5, rollout_policy=policy)
+        def search():
+            bot.select_move(root)
+            return num_rounds
+        num_rounds_done, elapsed = timed(duration, search)
+        print('mcts ({}): {:.0f} rounds/s'.format(name, num_rounds_done / elapsed))
+        # the uniform rate keeps the name it had before there were policies
+        key = 'mcts rounds/s' if name == 'uniform' else '{} mcts rounds/s'.format(name)
+        results[key] = num_rounds_done / elapsed
+    return results
+
+def bench_parallel_mcts(duration, num_rounds=20000):
+    # root parallelization: same total budget, 1 to cpu_count workers
+    root = c4board.GameState.new_game()
+    results = {}
+    base_rate = None
+    num_workers = 1
+    while num_workers <= os.cpu_count():
+        # uniform rollouts, as before there were policies
+        bot = MCTSAgent(num_rounds, 1.5, num_workers=num_workers,
+            rollout_policy=ROLLOUT_POLICIES['uniform'])
+        bot.select_move(root)  # warm up, forks the pool
+        def search():
+            bot.select_move(root)
+            return num_rounds
+        num_rounds_done, elapsed = timed(duration, search)
+        bot.close()
+        rate = num_rounds_done / elapsed
+        if base_rate is None:
+            base_rate = rate
+        print('parallel mcts ({} workers): {:.0f} rounds/s, {:.2f}x'.format(
+            num_workers, rate, rate / base_rate))
+        results['parallel mcts ({} workers) rounds/s'.format(num_workers)] = rate
+        num_workers *= 2
+    return results
+
+def bench_zero(duration, batch_size, num_rounds=400):
+    encoder = ZeroEncoder()
+    bot = ZeroAgent(StubModel(encoder.shape()), encoder, rounds_per_move=num_rounds,
+        batch_size=batch_size)
+    root = c4board.GameState.new_game()
+    def search():
+        bot.select_move(root)
+        return num_rounds
+    num_rounds_done, elapsed = timed(duration, search)
+    print('zero (batch {}): {:.0f} rounds/s'.format(batch_size, num_rounds_done / elapsed))
+    return {'zero (batch {}) rounds/s'.format(batch_size): num_rounds_done / elapsed}
+
+def bench_encoder(duration, batch_size):
+    encoder = ZeroEncoder()
+    states = []
+    while len(states) < batch_size:
+        game = c4board.GameState.new_game()
+        while not game.is_over() and len(states) < batch_size:
+            states.append(game)
+            game = game.apply_move(random.choice(game.legal_moves()))
+    out = np.zeros((batch_size,) + encoder.shape(), dtype=np.float32)
+    def encode():
+        encoder.encode_batch(states, out=out)
+        return batch_size
+    num_states, elapsed = timed(duration, encode)
+    print('encoder ({}): {:.0f} states/s'.format(batch_size, num_states / elapsed))
+    return {'encoder ({}) states/s'.format(batch_size): num_states / elapsed}
+
+# measures import, load and a first predict in a fresh interpreter
+STARTUP_SCRIPT = '''import sys, time
+start = time.perf_counter()
+import numpy as np
+{load}
+model.predict(np.zeros((1, 8, 6, 7), dtype=np.float32))
+print(time.perf_counter() - start)
+'''
+NUMPY_LOAD = 'from c4bot.numpy_model import NumpyModel; model = NumpyModel(sys.argv[1])'
+KERAS_LOAD = 'from keras.models import load_model; model = load_model(sys.argv[1])'
+
+def startup_time(load, path):
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT.format(load=load), path],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return float(output.split()[-1])
+
+def bench_inference(duration, model_path='best.npz', keras_path=None):
+    """NumPy engine against Keras: startup time and evals/s per batch size."""
+    if not os.path.exists(model_path):
+        print('inference: {} not found, export a model with export_model.py'.format(model_path))
+        return {}
+    from c4bot.numpy_model import NumpyModel
+    engines = [('numpy', NUMPY_LOAD, model_path, NumpyModel(model_path).predict)]
+    if keras_path is not None:
+        from keras.models import load_model
+        engines.append(('keras', KERAS_LOAD, keras_path, load_model(keras_path).predict_on_batch))
+
+    results = {}
+    input_shape = ZeroEncoder().shape()
+    for name, load, path, predict in engines:
+        seconds = startup_time(load, path)
+        print('{} startup: {:.2f}s'.format(name, seconds))
+        results['{} startup seconds'.format(name)] = seconds
+        for batch_size in (1, 4, 16, 64, 256):
+            model_input = np.random.randint(0, 2, (batch_size,) + input_shape).astype(np.float32)
+            def evaluate():
+                predict(model_input)
+                return batch_size
+            num_evals, elapsed = timed(duration, evaluate)
+            print('{} (batch {}): {:.0f} evals/s, {:.2f} ms/call'.format(
+                name, batch_size, num_evals / elapsed, elapsed / num_evals * batch_size * 1000))
+            results['{} (batch {}) evals/s'.format(name, batch_size)] = num_evals / elapsed
+    return results
+
+# commands of the command line interface, in python -m c4bot, that must
+# start without loading any of HEAVY_MODULES
+STARTUP_COMMANDS = {
+    'help': ['--help'],
+    'match': ['match', 'random', 'mcts:rounds=10', '--games', '2'],
+    'selfplay': ['selfplay', 'mcts:rounds=10', '--games', '1'],
+}
+HEAVY_MODULES = ('numpy', 'h5py', 'keras', 'tensorflow')
+
+def imported_modules(args):
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'c4bot'] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True).stderr
+    return [line.split('|')[-1].strip() for line in stderr.splitlines()
+            if line.startswith('import time:')]
+
+def bench_startup(duration):
+    """Wall time of short CLI commands, and how many heavy modules they import."""
+    results = {}
+    for name, args in STARTUP_COMMANDS.items():
+        heavy = [module for module in imported_modules(args)
+                 if module.split('.')[0] in HEAVY_MODULES]
+        def start():
+            subprocess.run([sys.executable, '-m', 'c4bot'] + args,
+                stdout=subprocess.DEVNULL, check=True)
+            return 1
+        num_runs, elapsed = timed(duration / len(STARTUP_COMMANDS), start)
+        print('startup ({}): {:.1f} ms, {} heavy imports{}'.format(
+            name, elapsed / num_runs * 1000, len(heavy),
+            ' ({})'.format(', '.join(heavy[:5])) if heavy else ''))
+        results['startup ({}) seconds'.format(name)] = elapsed / num_runs
+        results['startup ({}) heavy imports'.format(name)] = len(heavy)
+    return results
+
+def merge(*results):
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+BENCHMARKS = {
+    'perft': bench_perft,
+    'moves': bench_moves,
+    'rollouts': bench_rollouts,
+    'batch_rollouts': lambda duration: merge(*[
+        bench_batch_rollouts(duration, batch_size) for batch_size in (64, 256, 1024)
+    ]),
+    'rollout_policy': bench_rollout_policy,
+    'mcts': bench_mcts,
+    'parallel_mcts': bench_parallel_mcts,
+    'zero': lambda duration: merge(*[
+        bench_zero(duration, batch_size) for batch_size in (1, 16)
+    ]),
+    'encoder': lambda duration: merge(*[
+        bench_encoder(duration, batch_size) for batch_size in (1, 16, 256)
+    ]),
+    'inference': bench_inference,
+    'startup': bench_startup,
+}
+
+def compare(results, baseline, tolerance, tolerances, score_tolerance=0.15):
+    """Prints every metric against the baseline; returns the regressed ones."""
+    regressions = []
+    print('{:<40} {:>12} {:>12} {:>8}'.format('metric', 'baseline', 'current', 'change'))
+    for name, value in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if name.endswith('score'):
+            limit = tolerances.get(name, score_tolerance)
+            change = value - expected
+            failed = change < -limit
+            print('{:<40} {:>12.4g} {:>12.4g} {:>+8.3f}{}'.format(
+                name, expected, value, change, '  REGRESSION' if failed else ''))
+        elif name.endswith(('/s', 'seconds')):
+            limit = tolerances.get(name, tolerance)
+            if expected == 0:
+                change = 0.0 if value == 0 else float('inf')
+            else:
+                change = value / expected - 1
+            if name.endswith('seconds'):
+                failed = change > limit
+            else:
+                failed = change < -limit
+            print('{:<40} {:>12.4g} {:>12.4g} {:>+8.1%}{}'.format(
+                name, expected, value, change, '  REGRESSION' if failed else ''))
+        else:
+            failed = value != expected
+            print('{:<40} {:>12} {:>12}{}'.format(
+                name, expected, value, '  MISMATCH' if failed else ''))
+        if failed:
+            regressions.append(name)
+    return regressions
+
+def parse_tolerance(text):
+    name, _, fraction = text.rpartition('=')
+    if not name:
+        raise argparse.ArgumentTypeError('expected METRIC=FRACTION, got {}'.format(text))
+    return name, float(fraction)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the speed of the board, the agents and the encoder.')
+    parser.add_argument('benchmarks', nargs='*', help=', '.join(BENCHMARKS))
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results stored with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='allowed relative slowdown before a rate or time counts as a regression')
+    parser.add_argument('--score-tolerance', type=float, default=0.15,
+        help='allowed absolute drop of a match score before it counts as a regression')
+    parser.add_argument('--metric-tolerance', type=parse_tolerance, action='append', default=[],
+        metavar='METRIC=FRACTION', help='tolerance for a single metric, can be repeated')
+    parser.add_argument('--model', default='best.npz',
+        help='exported model for the inference benchmark')
+    parser.add_argument('--keras-model', help='Keras model to compare the inference benchmark with')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(name))
+
+    benchmarks = dict(BENCHMARKS)
+    benchmarks['inference'] = functools.partial(
+        bench_inference, model_path=args.model, keras_path=args.keras_model)
+
+    random.seed(1)
+    results = {}
+    for name in args.benchmarks or list(benchmarks):
+        results.update(benchmarks[name](args.duration))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'duration': args.duration,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(results, baseline, args.tolerance, dict(args.metric_tolerance),
+            args.score_tolerance)
+        if regressions:
+            print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
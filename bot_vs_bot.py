@@ -1,21 +1,25 @@
+import argparse
 import time
-from keras.models import load_model
 
-from c4bot import agent
 from c4bot import c4board
 from c4bot import c4types
+from c4bot.agent import registry
 from c4bot.utils import print_board, print_move
 
 def main():
-    # latest_model = load_model('latest.h5')
-    best_model = load_model('best_new.h5')
-    encoder = agent.ZeroEncoder()
-    bots = {
-        # c4types.Player.red: agent.ZeroAgent(latest_model, encoder),
-        # c4types.Player.yellow: agent.ZeroAgent(best_model, encoder),
-        c4types.Player.red: agent.ZeroAgent(best_model, encoder),
-        c4types.Player.yellow: agent.MCTSAgent(1000, 1.5),
-    }
+    parser = argparse.ArgumentParser(description='Watch two bots play each other.')
+    parser.add_argument('--red', default='zero:model=best_new.npz',
+        help='agent spec, see c4bot.agent.registry (default: %(default)s)')
+    parser.add_argument('--yellow', default='mcts:rounds=1000',
+        help='agent spec (default: %(default)s)')
+    args = parser.parse_args()
+    try:
+        bots = {
+            c4types.Player.red: registry.create_agent(args.red),
+            c4types.Player.yellow: registry.create_agent(args.yellow),
+        }
+    except ValueError as e:
+        parser.error(str(e))
     wins = {
         c4types.Player.red: 0,
         c4types.Player.yellow: 0,
@@ -0,0 +1,83 @@
+import argparse
+
+from c4bot import c4board
+from c4bot import c4types
+from c4bot.agent.mcts import MCTSAgent
+from c4bot.agent.solver import SolverAgent
+from c4bot.book import write_book
+
+# SolverAgent takes up to a minute per position at ply 10 and several
+# minutes at ply 8, so the book only solves positions from SOLVER_MIN_PLY on
+SOLVER_MIN_PLY = 10
+
+def solver_search():
+    solver = SolverAgent()
+    def search(game_state):
+        move, score = solver.best_move(game_state)
+        # keep the outcome only, as a value in [-1, 1]
+        return move, float((score > 0) - (score < 0))
+    return search
+
+def mcts_search(num_rounds, rollouts_per_leaf):
+    bot = MCTSAgent(num_rounds, 1.5, rollouts_per_leaf=rollouts_per_leaf)
+    def search(game_state):
+        root = bot.search(game_state)
+        child = max(root.children, key=lambda child: child.num_visits)
+        player = game_state.next_player
+        value = child.winning_pct(player) - child.winning_pct(player.other)
+        return child.move, value
+    return search
+
+def mixed_search(solver_from_ply, solver, mcts):
+    # the solver cannot reach the end of the game from early positions
+    def search(game_state):
+        if bin(game_state.board.mask).count('1') >= solver_from_ply:
+            return solver(game_state)
+        return mcts(game_state)
+    return search
+
+def collect(game_state, book_player, max_plies, search, entries):
+    # the book player follows its book move, the opponent may play anything
+    if game_state.is_over() or bin(game_state.board.mask).count('1') >= max_plies:
+        return
+    if game_state.next_player == book_player:
+        key = game_state.position_hash()
+        if key not in entries:
+            entries[key] = search(game_state)
+            if len(entries) % 100 == 0:
+                print('{} positions'.format(len(entries)))
+        moves = [entries[key][0]]
+    else:
+        moves = game_state.legal_moves()
+    for move in moves:
+        collect(game_state.apply_move(move), book_player, max_plies, search, entries)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an opening book file.')
+    parser.add_argument('output')
+    parser.add_argument('--plies', type=int, default=8)
+    parser.add_argument('--source', choices=['mcts', 'solver'], default='mcts')
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--rollouts-per-leaf', type=int, default=64)
+    parser.add_argument('--solver-from-ply', type=int, default=SOLVER_MIN_PLY,
+        help='with --source solver, positions before this ply are searched with MCTS')
+    args = parser.parse_args()
+
+    search = mcts_search(args.rounds, args.rollouts_per_leaf)
+    if args.source == 'solver':
+        if args.solver_from_ply < SOLVER_MIN_PLY:
+            parser.error('--solver-from-ply must be at least {}, earlier positions take '
+                'minutes each to solve'.format(SOLVER_MIN_PLY))
+        if args.solver_from_ply >= args.plies:
+            parser.error('--source solver needs --plies above --solver-from-ply ({})'.format(
+                args.solver_from_ply))
+        search = mixed_search(args.solver_from_ply, solver_search(), search)
+
+    entries = {}
+    for book_player in (c4types.Player.red, c4types.Player.yellow):
+        collect(c4board.GameState.new_game(), book_player, args.plies, search, entries)
+    write_book(args.output, entries)
+    print('Wrote {} positions to {}'.format(len(entries), args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import functools
+import os
+import random
+import sys
+import time
+
+from c4bot import c4board
+from c4bot import c4types
+from c4bot.agent import registry
+
+# Only what a command needs is imported, in the command itself: playing
+# random or mcts agents must not pay for NumPy models, Keras or h5py.
+
+SPEC_HELP = ("agent spec such as random, solver, 'mcts:rounds=500,temperature=1.5', "
+             "'mcts:time=2' or 'zero:model=best.npz,time=2'")
+
+def read_move(game):
+    legal_moves = game.legal_moves()
+    while True:
+        try:
+            text = input('-- ')
+        except EOFError:
+            sys.exit(1)
+        if text.strip().isdigit() and int(text) in legal_moves:
+            return int(text)
+        print('enter one of {}'.format(' '.join(str(move) for move in legal_moves)))
+
+def play(args):
+    from c4bot.utils import print_board, print_move
+
+    human = c4types.Player[args.color]
+    bot = registry.create_agent(args.agent)
+    game = c4board.GameState.new_game()
+    while not game.is_over():
+        print(chr(27) + '[2J')
+        print_board(game.board)
+        if game.next_player == human:
+            move = read_move(game)
+        else:
+            move = bot.select_move(game)
+        print_move(game.next_player, move)
+        game = game.apply_move(move)
+        if game.next_player == human and not game.is_over() and hasattr(bot, 'start_pondering'):
+            # keep searching while the human thinks about a reply
+            bot.start_pondering(game)
+    if hasattr(bot, 'stop_pondering'):
+        bot.stop_pondering()
+    print_board(game.board)
+    if game.winner() is None:
+        print('Draw')
+    else:
+        print('You win' if game.winner() == human else 'You lose')
+
+def match(args):
+    from c4bot import elo
+    from c4bot import tournament
+
+    games = tournament.schedule([(args.first, args.second)], args.games)
+    play_game = functools.partial(tournament.play_game, opening_plies=args.opening_plies)
+    test = elo.SPRT()
+    if args.workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(args.workers)
+        results = pool.imap_unordered(play_game, games)
+    else:
+        pool = None
+        results = map(play_game, games)
+    for result in results:
+        score = result['result'] if result['red'] == args.first else 1 - result['result']
+        test.record(score)
+        print('{} - {}: {}'.format(result['red'], result['yellow'], result['result']))
+    if pool is not None:
+        pool.close()
+    rating, low, high = test.elo()
+    print('{} vs {}: +{} ={} -{}, score {:.1%}, Elo {:.0f} [{:.0f}, {:.0f}]'.format(
+        args.first, args.second, test.wins, test.draws, test.losses, test.score(),
+        rating, low, high))
+
+def selfplay(args):
+    # red and yellow are separate agents, so that each collector sees one side
+    bots = {
+        c4types.Player.red: registry.create_agent(args.agent),
+        c4types.Player.yellow: registry.create_agent(args.agent),
+    }
+    collectors = {}
+    writer = None
+    if args.replay is not None:
+        if not hasattr(bots[c4types.Player.red], 'set_collector'):
+            sys.exit('{} does not record training data'.format(args.agent))
+        from c4bot import replay
+        writer = replay.ShardWriter(args.replay, 'selfplay{}'.format(os.getpid()))
+        for player, bot in bots.items():
+            collectors[player] = replay.ReplayCollector(writer)
+            bot.set_collector(collectors[player])
+
+    rng = random.Random(args.seed)
+    wins = {c4types.Player.red: 0, c4types.Player.yellow: 0, None: 0}
+    start = time.perf_counter()
+    for _ in range(args.games):
+        for collector in collectors.values():
+            collector.begin_episode()
+        game = c4board.GameState.new_game()
+        for _ in range(args.opening_plies):
+            if game.is_over():
+                break
+            game = game.apply_move(rng.choice(game.legal_moves()))
+        while not game.is_over():
+            game = game.apply_move(bots[game.next_player].select_move(game))
+        winner = game.winner()
+        wins[winner] += 1
+        for player, collector in collectors.items():
+            collector.complete_episode(0 if winner is None else (1 if winner == player else -1))
+    elapsed = time.perf_counter() - start
+
+    if writer is not None:
+        writer.close()
+    for bot in bots.values():
+        if hasattr(bot, 'close'):
+            bot.close()
+    print('{} games in {:.1f}s: red {}, yellow {}, draws {}'.format(
+        args.games, elapsed, wins[c4types.Player.red], wins[c4types.Player.yellow], wins[None]))
+    if collectors:
+        num_positions = sum(collector.num_positions for collector in collectors.values())
+        print('{} positions written to {}'.format(num_positions, args.replay))
+
+def serve(args):
+    import asyncio
+    from c4bot import server
+
+    try:
+        asyncio.run(server.serve(args.agent, args.host, args.port, args.max_batch_size))
+    except KeyboardInterrupt:
+        pass
+
+def spec(text):
+    try:
+        registry.parse_spec(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m c4bot', description='Connect 4 agents.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_play = commands.add_parser('play', help='play against an agent')
+    parser_play.add_argument('agent', type=spec, help=SPEC_HELP)
+    parser_play.add_argument('--color', choices=['red', 'yellow'], default='yellow',
+        help='your color; red moves first')
+    parser_play.set_defaults(run=play)
+
+    parser_match = commands.add_parser('match', help='play games between two agents')
+    parser_match.add_argument('first', type=spec, help=SPEC_HELP)
+    parser_match.add_argument('second', type=spec, help=SPEC_HELP)
+    parser_match.add_argument('--games', type=int, default=10,
+        help='games, with colors alternating')
+    parser_match.add_argument('--opening-plies', type=int, default=2,
+        help='random plies played before the agents take over')
+    parser_match.add_argument('--workers', type=int, default=1)
+    parser_match.set_defaults(run=match)
+
+    parser_selfplay = commands.add_parser('selfplay', help='let an agent play itself')
+    parser_selfplay.add_argument('agent', type=spec, help=SPEC_HELP)
+    parser_selfplay.add_argument('--games', type=int, default=10)
+    parser_selfplay.add_argument('--opening-plies', type=int, default=0,
+        help='random plies played before the agents take over')
+    parser_selfplay.add_argument('--seed', type=int, default=None,
+        help='seed of the random openings')
+    parser_selfplay.add_argument('--replay', default=None,
+        help='directory to write the positions to, as training shards')
+    parser_selfplay.set_defaults(run=selfplay)
+
+    parser_serve = commands.add_parser('serve',
+        help='host games against an agent over TCP, one JSON object per line')
+    parser_serve.add_argument('agent', type=spec, help=SPEC_HELP)
+    parser_serve.add_argument('--host', default='127.0.0.1')
+    parser_serve.add_argument('--port', type=int, default=4004)
+    parser_serve.add_argument('--max-batch-size', type=int, default=256,
+        help='rows per predict call shared by all sessions')
+    parser_serve.set_defaults(run=serve)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
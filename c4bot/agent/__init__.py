@@ -1,3 +1,34 @@
-from .naive import *
-from .mcts import *
-from .zero import *
+import importlib
+
+# Agents are imported on first use, so that e.g. agent.RandomBot does not
+# load NumPy and the neural network code of the zero agent.
+_EXPORTS = {
+    'naive': ('RandomBot',),
+    'mcts': (
+        'EARLY_STOP_INTERVAL', 'show_tree', 'utc_score', 'MCTSStats', 'lookup_stats',
+        'MCTSNode', 'root_search', 'MCTSAgent',
+    ),
+    'solver': ('NUM_CELLS', 'COLUMN_ORDER', 'COLUMN_MASKS', 'winning_cells', 'SolverAgent'),
+    'zero': (
+        'ZeroEncoder', 'ZeroTree', 'mirror_experience', 'policy_target',
+        'ZeroExperienceCollector', 'ZeroExperienceBuffer', 'ZeroAgent',
+    ),
+}
+_MODULES = {'Agent': 'base', 'SearchBudget': 'base', 'REUSE_DEPTH': 'base', 'find_reusable': 'base'}
+for _module, _names in _EXPORTS.items():
+    _MODULES.update(dict.fromkeys(_names, _module))
+_SUBMODULES = ('base', 'naive', 'mcts', 'solver', 'zero', 'registry')
+
+__all__ = sorted(_MODULES)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    if name not in _MODULES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES) | set(_SUBMODULES))
@@ -1,6 +1,90 @@
+import time
+
+from c4bot.telemetry import MoveStats
+
+class SearchBudget():
+    """Rounds and time left for one search.
+
+    A search ends after max_rounds rounds or, with a time_budget in seconds,
+    at the deadline, whichever comes first. rounds starts at the rounds a
+    reused tree already holds and is advanced by the search.
+    """
+    def __init__(self, max_rounds, rounds=0, time_budget=None):
+        self.max_rounds = max_rounds
+        self.rounds = rounds
+        self.start = time.perf_counter()
+        self.deadline = None if time_budget is None else self.start + time_budget
+        self._start_rounds = rounds
+
+    def exhausted(self):
+        if self.rounds >= self.max_rounds:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def remaining(self):
+        """Estimates the rounds left, from the rate so far when there is a deadline."""
+        remaining = self.max_rounds - self.rounds
+        if self.deadline is not None:
+            now = time.perf_counter()
+            rate = (self.rounds - self._start_rounds) / max(now - self.start, 1e-9)
+            remaining = min(remaining, rate * (self.deadline - now))
+        return max(remaining, 0)
+
+    def decided(self, visit_counts):
+        """True if no move can catch up with the most visited one in the rounds left.
+
+        visit_counts holds the counts of all legal moves at the root.
+        """
+        if len(visit_counts) < 2:
+            return True
+        second, first = sorted(visit_counts)[-2:]
+        return first - second > self.remaining()
+
+# A kept tree is searched for the new root down to this many plies: the
+# new position is the old root itself, its child after our move or its
+# grandchild after the opponent's reply.
+REUSE_DEPTH = 2
+
+def find_reusable(root, key, node_key, children):
+    """Breadth-first search for the node with position hash key.
+
+    Looks at root and the nodes up to REUSE_DEPTH plies below it, using
+    node_key(node) for a node's hash and children(node) for its children.
+    Returns None if no node matches.
+    """
+    nodes = [root]
+    for depth in range(REUSE_DEPTH + 1):
+        for node in nodes:
+            if node_key(node) == key:
+                return node
+        if depth < REUSE_DEPTH:
+            nodes = [child for node in nodes for child in children(node)]
+    return None
+
 class Agent:
+    # receives a MoveStats per move when set, see set_stats_sink
+    stats_sink = None
+
     def __init__(self):
         pass
 
     def select_move(self, game_state):
         raise NotImplementedError()
+
+    def set_stats_sink(self, sink):
+        """Records search statistics for every move to sink, or stops with None.
+
+        A sink is any object with a record(move_stats) method, such as
+        telemetry.JsonlSink.
+        """
+        self.stats_sink = sink
+
+    def begin_stats(self, game_state):
+        if self.stats_sink is None:
+            return None
+        return MoveStats(type(self).__name__, game_state)
+
+    def end_stats(self, stats, move):
+        if stats is not None:
+            stats.finish(move)
+            self.stats_sink.record(stats)
@@ -1,8 +1,14 @@
 import random
 import math
 
+from c4bot.c4board import SearchPosition
 from c4bot.c4types import Player
+from c4bot.playout import tactical_rollout
 from c4bot import agent
+from c4bot.agent.base import SearchBudget, find_reusable
+
+# rounds between two early stopping checks
+EARLY_STOP_INTERVAL = 16
 
 def show_tree(node, indent='', max_depth=3):
     if max_depth < 0:
@@ -26,31 +32,58 @@ def utc_score(parent_rollouts, child_rollouts, win_pct, temperature):
     exploration = math.sqrt(math.log(parent_rollouts) / child_rollouts)
     return win_pct + temperature * exploration
 
-class MCTSNode:
-    def __init__(self, game_state, parent=None, move=None):
-        self.game_state = game_state
-        self.parent = parent
-        self.move = move
+class MCTSStats:
+    def __init__(self):
         self.win_counts = {
             None: 0,
             Player.red: 0,
             Player.yellow: 0,
         }
         self.num_rollouts = 0
+
+def lookup_stats(transposition_table, game_state):
+    # nodes for the same position, or its mirror image, share one MCTSStats
+    # through the table
+    if transposition_table is None:
+        return MCTSStats()
+    key = game_state.canonical_hash()
+    stats = transposition_table.get(key)
+    if stats is None:
+        stats = MCTSStats()
+        transposition_table.put(key, stats)
+    return stats
+
+class MCTSNode:
+    def __init__(self, game_state, parent=None, move=None, transposition_table=None):
+        self.game_state = game_state
+        self.parent = parent
+        self.move = move
+        self.transposition_table = transposition_table
+        self.stats = lookup_stats(transposition_table, game_state)
+        # rounds that passed through this node in this tree
+        self.num_visits = 0
         self.children = []
         self.unvisited_moves = game_state.legal_moves()
 
+    @property
+    def win_counts(self):
+        return self.stats.win_counts
+
+    @property
+    def num_rollouts(self):
+        return self.stats.num_rollouts
+
     def add_random_child(self):
         index = random.randint(0, len(self.unvisited_moves) - 1)
         new_move = self.unvisited_moves.pop(index)
         new_game_state = self.game_state.apply_move(new_move)
-        new_node = MCTSNode(new_game_state, self, new_move)
+        new_node = MCTSNode(new_game_state, self, new_move, self.transposition_table)
         self.children.append(new_node)
         return new_node
 
-    def record_win(self, winner):
-        self.win_counts[winner] += 1
-        self.num_rollouts += 1
+    def record_win(self, winner, count=1):
+        self.stats.win_counts[winner] += count
+        self.stats.num_rollouts += count
 
     def can_add_child(self):
         return len(self.unvisited_moves) > 0
@@ -61,38 +94,186 @@ class MCTSNode:
     def winning_pct(self, player):
         return float(self.win_counts[player]) / float(self.num_rollouts)
 
+def root_search(args):
+    # runs in a pool worker: one independent search from the shared root
+    (game_state, num_rounds, temperature, rollouts_per_leaf, rollout_policy, time_budget,
+        early_stop, seed) = args
+    random.seed(seed)
+    if rollouts_per_leaf > 1:
+        import numpy as np
+        np.random.seed(seed)
+    bot = MCTSAgent(num_rounds, temperature, rollouts_per_leaf=rollouts_per_leaf,
+        time_budget=time_budget, early_stop=early_stop, rollout_policy=rollout_policy)
+    root = bot.search(game_state)
+    return [(child.move, dict(child.win_counts)) for child in root.children]
+
 class MCTSAgent(agent.Agent):
-    def __init__(self, num_rounds, temperature):
+    def __init__(self, num_rounds, temperature, rollouts_per_leaf=1, transposition_table=None,
+                 reuse_tree=False, opening_book=None, num_workers=1, time_budget=None,
+                 early_stop=False, rollout_policy=tactical_rollout):
+        # with num_workers > 1 every worker searches a tree of its own: there
+        # is no shared transposition_table or reused tree, and a stats sink
+        # gets the rounds and root visits of a move but no phase timings,
+        # depths, node counts or cache hits
+        if num_workers > 1 and transposition_table is not None:
+            raise ValueError('transposition_table needs num_workers=1')
+        if num_workers > 1 and reuse_tree:
+            raise ValueError('reuse_tree needs num_workers=1')
         self.num_rounds = num_rounds
+        self.time_budget = time_budget
+        self.early_stop = early_stop
         self.temperature = temperature
+        self.rollouts_per_leaf = rollouts_per_leaf
+        # plays out a leaf with a single rollout, see c4bot.playout; batched
+        # rollouts are always uniform
+        self.rollout_policy = rollout_policy
+        self.transposition_table = transposition_table
+        self.reuse_tree = reuse_tree
+        self.root = None
+        self.opening_book = opening_book
+        # root parallelization: num_workers processes split num_rounds
+        self.num_workers = num_workers
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state.pop('stats_sink', None)
+        return state
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
 
     def select_move(self, game_state):
-        root = MCTSNode(game_state)
+        if self.opening_book is not None:
+            entry = self.opening_book.lookup(game_state)
+            if entry is not None:
+                return entry[0]
 
-        for i in range(self.num_rounds):
+        stats = self.begin_stats(game_state)
+        if self.num_workers > 1:
+            child_win_counts = self.parallel_search(game_state)
+            if stats is not None:
+                # every round adds rollouts_per_leaf rollouts below one child
+                num_rollouts = sum(sum(win_counts.values()) for _, win_counts in child_win_counts)
+                stats.rounds = num_rollouts // self.rollouts_per_leaf
+        else:
+            root = self.search(game_state, stats)
+            child_win_counts = [(child.move, child.win_counts) for child in root.children]
+
+        best_move = None
+        best_score = -1.0
+        for move, win_counts in child_win_counts:
+            if self.early_stop or self.time_budget is not None:
+                # a search cut short plays the move its stopping rule settled
+                # on, not a rarely visited one with an unsettled win rate
+                child_score = float(sum(win_counts.values()))
+            else:
+                child_score = float(win_counts[game_state.next_player]) / float(sum(win_counts.values()))
+            if child_score > best_score:
+                best_score = child_score
+                best_move = move
+        if best_move is None:
+            # the time budget ran out before the first round
+            best_move = random.choice(game_state.legal_moves())
+
+        if stats is not None:
+            for move, win_counts in child_win_counts:
+                stats.root_visits[move] = sum(win_counts.values())
+        self.end_stats(stats, best_move)
+        return best_move
+
+    def parallel_search(self, game_state):
+        if self._pool is None:
+            import multiprocessing
+            # kept across moves so workers are only forked once
+            self._pool = multiprocessing.Pool(self.num_workers)
+
+        # a detached copy pickles without its previous_state chain
+        root_state = SearchPosition(game_state).to_game_state()
+        tasks = []
+        for worker in range(self.num_workers):
+            num_rounds = self.num_rounds // self.num_workers
+            if worker < self.num_rounds % self.num_workers:
+                num_rounds += 1
+            seed = random.getrandbits(32)
+            tasks.append((root_state, num_rounds, self.temperature, self.rollouts_per_leaf,
+                self.rollout_policy, self.time_budget, self.early_stop, seed))
+
+        merged = {}
+        for results in self._pool.map(root_search, tasks):
+            for move, win_counts in results:
+                if move not in merged:
+                    merged[move] = dict.fromkeys(win_counts, 0)
+                for winner, count in win_counts.items():
+                    merged[move][winner] += count
+        return sorted(merged.items(), key=lambda item: item[0])
+
+    def search(self, game_state, stats=None):
+        table = self.transposition_table
+        if stats is not None and table is not None:
+            hits, misses = table.hits, table.misses
+        root = None
+        if self.reuse_tree and self.root is not None:
+            root = self.find_subtree(game_state)
+        if root is None:
+            root = MCTSNode(game_state, transposition_table=table)
+
+        budget = SearchBudget(self.num_rounds, root.num_visits, self.time_budget)
+        while not budget.exhausted():
             node = root
+            depth = 0
             while (not node.can_add_child()) and (not node.is_terminal()):
                 node = self.select_child(node)
-            
+                depth += 1
+            if stats is not None:
+                stats.lap('selection')
+
             if node.can_add_child():
                 node = node.add_random_child()
+                depth += 1
+                if stats is not None:
+                    stats.nodes += 1
+                    stats.lap('expansion')
 
-            winner = self.simulate_random_game(node.game_state)
+            win_counts = self.simulate_random_games(node.game_state)
+            if stats is not None:
+                stats.lap('simulation')
 
             while node is not None:
-                node.record_win(winner)
+                node.num_visits += 1
+                for winner, count in win_counts.items():
+                    node.record_win(winner, count)
                 node = node.parent
+            if stats is not None:
+                stats.lap('backup')
+                stats.rounds += 1
+                stats.record_depth(depth)
 
-        best_move = None
-        best_pct = -1.0
-        for child in root.children:
-            child_pct = child.winning_pct(game_state.next_player)
-            if child_pct > best_pct:
-                best_pct = child_pct
-                best_move = child.move
+            budget.rounds += 1
+            if self.early_stop and budget.rounds % EARLY_STOP_INTERVAL == 0:
+                visit_counts = [child.num_visits for child in root.children]
+                if budget.decided(visit_counts + [0] * len(root.unvisited_moves)):
+                    break
+
+        if stats is not None and table is not None:
+            stats.cache_hits = table.hits - hits
+            stats.cache_misses = table.misses - misses
 
+        if self.reuse_tree:
+            self.root = root
         # show_tree(root, '', 1)
-        return best_move
+        return root
+
+    def find_subtree(self, game_state):
+        node = find_reusable(self.root, game_state.position_hash(),
+            lambda node: node.game_state.position_hash(), lambda node: node.children)
+        if node is not None:
+            # detach so the rest of the old tree can be freed
+            node.parent = None
+        return node
 
     def select_child(self, node):
         total_rollouts = sum(child.num_rollouts for child in node.children)
@@ -111,15 +292,9 @@ class MCTSAgent(agent.Agent):
                 best_child = child
         return best_child
 
-    def simulate_random_game(self, game_state):
-        bots = {
-            Player.red: agent.RandomBot(),
-            Player.yellow: agent.RandomBot(),
-        }
-        while not game_state.is_over():
-            bot_move = bots[game_state.next_player].select_move(game_state)
-            game_state = game_state.apply_move(bot_move)
-        if game_state.board.is_winning_move(game_state.last_move):
-            return game_state.next_player.other
-        else:
-            return None
+    def simulate_random_games(self, game_state):
+        if self.rollouts_per_leaf > 1:
+            # NumPy is only imported by agents that batch their rollouts
+            from c4bot.rollout import batch_rollouts
+            return batch_rollouts(game_state, self.rollouts_per_leaf)
+        return {self.rollout_policy(game_state): 1}
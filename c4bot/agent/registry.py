@@ -0,0 +1,135 @@
+import importlib
+
+# Agents are given as specs: a kind, optionally followed by ':' and
+# comma-separated key=value parameters, e.g. 'mcts:rounds=500,temperature=1.5'
+# or 'zero:model=best.npz,time=2'. With time, in seconds per move, the
+# search stops at the deadline or once its choice is settled. mcts takes a
+# rollout policy from c4bot.playout, e.g. policy=uniform.
+
+# kind -> (module, class name); the module is imported when an agent of that
+# kind is first created
+AGENTS = {
+    'random': ('c4bot.agent.naive', 'RandomBot'),
+    'mcts': ('c4bot.agent.mcts', 'MCTSAgent'),
+    'solver': ('c4bot.agent.solver', 'SolverAgent'),
+    'zero': ('c4bot.agent.zero', 'ZeroAgent'),
+}
+# kinds that need a model parameter
+NEURAL_KINDS = {'zero'}
+# spec parameters each kind accepts
+PARAMETERS = {
+    'random': set(),
+    'mcts': {'rounds', 'time', 'temperature', 'rollouts', 'policy'},
+    'solver': {'entries'},
+    'zero': {'model', 'rounds', 'time', 'c', 'batch'},
+}
+
+# rounds when only a time budget is given
+UNLIMITED_ROUNDS = 1000000
+
+_factories = {}
+_models = {}
+
+def register(kind, module, class_name, factory=None, neural=False, parameters=()):
+    """Adds an agent kind that specs can name.
+
+    factory(cls, params) builds an agent from the spec parameters; without
+    one the class is called without arguments. parameters names the keys a
+    spec may set. Neural kinds need a model.
+    """
+    AGENTS[kind] = (module, class_name)
+    PARAMETERS[kind] = set(parameters)
+    if neural:
+        PARAMETERS[kind].add('model')
+    if factory is not None:
+        _factories[kind] = factory
+    if neural:
+        NEURAL_KINDS.add(kind)
+
+def agent_class(kind):
+    module, class_name = AGENTS[kind]
+    return getattr(importlib.import_module(module), class_name)
+
+def parse_spec(spec):
+    kind, _, arguments = spec.partition(':')
+    if kind not in AGENTS:
+        raise ValueError('unknown agent kind {!r} in {!r}'.format(kind, spec))
+    params = {}
+    for item in arguments.split(','):
+        if not item:
+            continue
+        key, equals, value = item.partition('=')
+        if not equals:
+            raise ValueError('expected key=value, got {!r} in {!r}'.format(item, spec))
+        if key not in PARAMETERS[kind]:
+            raise ValueError('{} agents take no parameter {!r} in {!r}'.format(kind, key, spec))
+        params[key] = value
+    if kind in NEURAL_KINDS and 'model' not in params:
+        raise ValueError('{!r} needs a model file'.format(spec))
+    return kind, params
+
+def is_neural(spec):
+    return parse_spec(spec)[0] in NEURAL_KINDS
+
+def create_agent(spec):
+    kind, params = parse_spec(spec)
+    cls = agent_class(kind)
+    factory = _factories.get(kind)
+    if factory is None:
+        return cls()
+    return factory(cls, params)
+
+def load_model(path):
+    # a process loads each model file once; exported .npz models run on the
+    # NumPy engine, anything else is loaded with Keras
+    if path not in _models:
+        if path.endswith('.npz'):
+            from c4bot.numpy_model import NumpyModel
+            _models[path] = NumpyModel(path)
+        else:
+            from keras.models import load_model
+            _models[path] = load_model(path)
+    return _models[path]
+
+def _search_limits(params, default_rounds):
+    if 'time' not in params:
+        return int(params.get('rounds', default_rounds)), None
+    return int(params.get('rounds', UNLIMITED_ROUNDS)), float(params['time'])
+
+def _create_mcts(cls, params):
+    from c4bot.playout import ROLLOUT_POLICIES
+
+    rounds, time_budget = _search_limits(params, 1000)
+    policy = params.get('policy', 'tactical')
+    if policy not in ROLLOUT_POLICIES:
+        raise ValueError('unknown rollout policy {!r}'.format(policy))
+    return cls(
+        rounds,
+        float(params.get('temperature', 1.5)),
+        rollouts_per_leaf=int(params.get('rollouts', 1)),
+        time_budget=time_budget,
+        early_stop=time_budget is not None,
+        rollout_policy=ROLLOUT_POLICIES[policy],
+    )
+
+def _create_solver(cls, params):
+    if 'entries' in params:
+        return cls(max_entries=int(params['entries']))
+    return cls()
+
+def _create_zero(cls, params):
+    from c4bot.agent.zero import ZeroEncoder
+
+    rounds, time_budget = _search_limits(params, 1600)
+    return cls(
+        load_model(params['model']),
+        ZeroEncoder(),
+        rounds_per_move=rounds,
+        c=float(params.get('c', 2.0)),
+        batch_size=int(params.get('batch', 1)),
+        reuse_tree=True,
+        time_budget=time_budget,
+        early_stop=time_budget is not None,
+    )
+
+_factories.update({'mcts': _create_mcts, 'solver': _create_solver, 'zero': _create_zero})
@@ -1,8 +1,21 @@
 import random
+import threading
+
 import numpy as np
-from keras.optimizers import SGD
 
 from c4bot import agent
+from c4bot.agent.base import SearchBudget, find_reusable
+from c4bot.c4board import BOARD_MASK, BOTTOM_MASK, STRIDE, SearchPosition
+
+_BOTTOM_MASK = np.uint64(BOTTOM_MASK)
+_BOARD_MASK = np.uint64(BOARD_MASK)
+# bit of every (row, column) cell, laid out like one encoder plane
+_CELL_SHIFTS = np.array(
+    [[column * STRIDE + row for column in range(7)] for row in range(6)], dtype=np.uint64)
+_ROWS = np.arange(6)
+
+def _cells(bits):
+    return (bits[:, np.newaxis, np.newaxis] >> _CELL_SHIFTS) & np.uint64(1)
 
 class ZeroEncoder():
     def __init__(self):
@@ -14,80 +27,164 @@ class ZeroEncoder():
         self.num_planes = 8
 
     def encode(self, game_state):
-        board_tensor = np.zeros(self.shape())
-        next_player = game_state.next_player
-      
-        for column in range(7):
-            height = game_state.board.heights[column]
-            for row in range(6):
-                slot = game_state.board.get(column, row)
-                if slot is not None:
-                    if slot == next_player:
-                        board_tensor[6][row][column] = 1
-                    else:
-                        board_tensor[7][row][column] = 1
-
-                if row == height:
-                    board_tensor[height][row][column] = 1
-
-        return board_tensor
+        return self.encode_batch([game_state])[0]
+
+    def encode_batch(self, game_states, out=None, canonical=False):
+        """Encodes game_states into one float32 array straight from the bitboards.
+
+        Pass a preallocated array of at least len(game_states) rows as out to
+        reuse it; the filled part is returned. With canonical set, states are
+        encoded in their canonical orientation (see GameState.canonical).
+        """
+        num_states = len(game_states)
+        if out is None:
+            out = np.zeros((num_states,) + self.shape(), dtype=np.float32)
+        else:
+            out = out[:num_states]
+            out.fill(0)
+
+        current = np.array(
+            [state.board.stones(state.next_player) for state in game_states], dtype=np.uint64)
+        mask = np.array([state.board.mask for state in game_states], dtype=np.uint64)
+        # the lowest free cell of each column, nothing for full columns
+        free = (mask + _BOTTOM_MASK) & _BOARD_MASK
+
+        out[:, 6] = _cells(current)
+        out[:, 7] = _cells(mask ^ current)
+        out[:, _ROWS, _ROWS] = _cells(free)
+        if canonical:
+            flip = np.array([state.is_mirrored() for state in game_states], dtype=bool)
+            out[flip] = self.mirror(out[flip])
+        return out
+
+    def mirror(self, encoded):
+        """Reflects encoded states left to right."""
+        return encoded[..., ::-1]
 
     def shape(self):
         return self.num_planes, 6, 7
 
-class Branch:
-    def __init__(self, prior):
-        self.prior = prior
-        self.visit_count = 0
-        self.total_value = 0.0
-
-class ZeroTreeNode:
-    def __init__(self, state, value, priors, parent, last_move):
-        self.state = state
-        self.value = value
-        self.parent = parent
-        self.last_move = last_move
-        self.total_visit_count = 1
-        self.branches = {}
-        for move, p in priors.items():
-            if state.is_valid_move(move):
-                self.branches[move] = Branch(p)
-        self.children = {}
-        # if parent is None:
-        #     print('Priors', priors)
-
-    def moves(self):
-        # return self.branches.keys()
-        moves = self.branches.keys()
-        return random.sample(moves, k=len(moves))
-
-    def add_child(self, move, child_node):
-        self.children[move] = child_node
-
-    def has_child(self, move):
-        return move in self.children
-
-    def get_child(self, move):
-        return self.children[move]
-
-    def expected_value(self, move):
-        branch = self.branches[move]
-        if branch.visit_count == 0:
-            return 0.0
-        return branch.total_value / branch.visit_count
-
-    def prior(self, move):
-        return self.branches[move].prior
-        
-    def visit_count(self, move):
-        if move in self.branches:
-            return self.branches[move].visit_count
-        return 0  # TODO: check if this is ever used
-
-    def record_visit(self, move, value):
-        self.total_visit_count += 1
-        self.branches[move].visit_count += 1
-        self.branches[move].total_value += value
+class ZeroTree:
+    """Search tree stored as a struct of arrays.
+
+    Nodes are row indices and every per-move statistic is a column, so a
+    node costs a few hundred bytes and PUCT scores all seven moves in one
+    vector operation. Node 0 is the root. Rows are allocated in chunks of
+    chunk_size; missing children are -1.
+    """
+    _COLUMNS = (
+        'priors', 'legal', 'visit_counts', 'total_values', 'virtual_losses', 'children',
+        'values', 'parents', 'last_moves', 'total_visit_counts', 'total_virtual_losses', 'hashes',
+    )
+
+    def __init__(self, chunk_size=1024):
+        self.chunk_size = chunk_size
+        self.num_nodes = 0
+        self.priors = np.zeros((0, 7), dtype=np.float32)
+        self.legal = np.zeros((0, 7), dtype=bool)
+        self.visit_counts = np.zeros((0, 7), dtype=np.int32)
+        self.total_values = np.zeros((0, 7), dtype=np.float64)
+        self.virtual_losses = np.zeros((0, 7), dtype=np.int32)
+        self.children = np.zeros((0, 7), dtype=np.int32)
+        self.values = np.zeros(0, dtype=np.float32)
+        self.parents = np.zeros(0, dtype=np.int32)
+        self.last_moves = np.zeros(0, dtype=np.int8)
+        self.total_visit_counts = np.zeros(0, dtype=np.int32)
+        self.total_virtual_losses = np.zeros(0, dtype=np.int32)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+
+    def _grow(self):
+        for name in self._COLUMNS:
+            column = getattr(self, name)
+            chunk = np.zeros((self.chunk_size,) + column.shape[1:], dtype=column.dtype)
+            setattr(self, name, np.concatenate([column, chunk]))
+
+    def add_node(self, position_hash, value, priors, legal, parent=-1, last_move=-1):
+        if self.num_nodes == len(self.values):
+            self._grow()
+        node = self.num_nodes
+        self.num_nodes += 1
+        self.priors[node] = priors
+        self.legal[node] = legal
+        self.children[node] = -1
+        self.values[node] = value
+        self.parents[node] = parent
+        self.last_moves[node] = last_move
+        self.total_visit_counts[node] = 1
+        self.hashes[node] = position_hash
+        if parent >= 0:
+            self.children[parent, last_move] = node
+        return node
+
+    def child(self, node, move):
+        return int(self.children[node, move])
+
+    def select_branch(self, node, c):
+        # pending virtual losses count as visits that lost
+        n = self.visit_counts[node] + self.virtual_losses[node]
+        w = self.total_values[node] - self.virtual_losses[node]
+        q = np.divide(w, n, out=np.zeros(7), where=n > 0)
+        total_n = self.total_visit_counts[node] + self.total_virtual_losses[node]
+        scores = q + c * self.priors[node] * np.sqrt(total_n) / (n + 1)
+        return self._argmax(scores, node)
+
+    def best_move(self, node):
+        return self._argmax(self.visit_counts[node].astype(np.float64), node)
+
+    def _argmax(self, scores, node):
+        # ties between legal moves are broken at random
+        scores[~self.legal[node]] = -np.inf
+        best = np.flatnonzero(scores == scores.max())
+        if len(best) == 1:
+            return int(best[0])
+        return int(random.choice(best))
+
+    def add_virtual_loss(self, node, move):
+        self.total_virtual_losses[node] += 1
+        self.virtual_losses[node, move] += 1
+
+    def remove_virtual_loss(self, node, move):
+        self.total_virtual_losses[node] -= 1
+        self.virtual_losses[node, move] -= 1
+
+    def record_visit(self, node, move, value):
+        self.total_visit_counts[node] += 1
+        self.visit_counts[node, move] += 1
+        self.total_values[node, move] += value
+
+    def subtree(self, node):
+        """Copies the subtree below node into a new tree with node as its root."""
+        order = [np.array([node])]
+        frontier = order[0]
+        while len(frontier) > 0:
+            frontier = self.children[frontier].ravel()
+            frontier = frontier[frontier >= 0]
+            order.append(frontier)
+        order = np.concatenate(order)
+
+        remap = np.full(self.num_nodes + 1, -1, dtype=np.int32)
+        remap[order] = np.arange(len(order))
+        tree = ZeroTree(self.chunk_size)
+        for name in self._COLUMNS:
+            setattr(tree, name, getattr(self, name)[order])
+        # index -1 maps to remap[-1], which stays -1
+        tree.children = remap[tree.children]
+        tree.parents = remap[tree.parents]
+        tree.parents[0] = -1
+        tree.num_nodes = len(order)
+        return tree
+
+def mirror_experience(states, visit_counts, rewards):
+    """Appends the mirror image of every position, with reversed visit counts."""
+    return (
+        np.concatenate([states, states[..., ::-1]]),
+        np.concatenate([visit_counts, visit_counts[:, ::-1]]),
+        np.concatenate([rewards, rewards]),
+    )
+
+def policy_target(visit_counts):
+    visit_sums = np.sum(visit_counts, axis=1).reshape((visit_counts.shape[0], 1))
+    return visit_counts / visit_sums
 
 class ZeroExperienceCollector:
     def __init__(self):
@@ -139,85 +236,275 @@ class ZeroExperienceBuffer:
 
 
 class ZeroAgent(agent.Agent):
-    def __init__(self, model, encoder, rounds_per_move=1600, c=2.0):
+    def __init__(self, model, encoder, rounds_per_move=1600, c=2.0, batch_size=1,
+                 transposition_table=None, reuse_tree=False, opening_book=None, time_budget=None,
+                 early_stop=False):
         self.model = model
         self.encoder = encoder
+        # caches (priors, value) network outputs by position hash
+        self.transposition_table = transposition_table
 
         self.collector = None
 
         self.num_rounds = rounds_per_move
+        self.time_budget = time_budget
+        self.early_stop = early_stop
         self.c = c
+        # number of leaves collected per pass and evaluated with one predict
+        self.batch_size = batch_size
+        # keep the searched tree for the next select_move call
+        self.reuse_tree = reuse_tree
+        self.tree = None
+        self.opening_book = opening_book
+        self._input_buffer = None
+        self._ponder_thread = None
+        self._ponder_stop = threading.Event()
 
     def set_collector(self, collector):
         self.collector = collector
 
-    def select_branch(self, node):
-        total_n = node.total_visit_count
-
-        def score_branch(move):
-            q = node.expected_value(move)
-            p = node.prior(move)
-            n = node.visit_count(move)
-            return q + self.c * p * np.sqrt(total_n) / (n + 1)
-
-        return max(node.moves(), key=score_branch)
-
     def select_move(self, game_state):
-        root = self.create_node(game_state)
-
-        for i in range(self.num_rounds):
-            node = root
-            next_move = self.select_branch(node)
-            while node.has_child(next_move):
-                node = node.get_child(next_move)
-                next_move = self.select_branch(next_move)
-
-            new_state = node.state.apply_move(next_move)
-            child_node = self.create_node(new_state, parent=node)
-
-            move = next_move
-            value = -1 * child_node.value
-            while node is not None:
-                node.record_visit(move, value)
-                move = node.last_move   
-                node = node.parent
-                value = -1 * value
+        return self.run(self.select_move_steps(game_state))
+
+    def run(self, steps):
+        """Drives a search generator such as select_move_steps with self.model."""
+        try:
+            model_input = next(steps)
+            while True:
+                model_input = steps.send(self.model.predict(model_input, batch_size=len(model_input)))
+        except StopIteration as stop:
+            return stop.value
+
+    def select_move_steps(self, game_state):
+        """Generator behind select_move that leaves inference to its caller.
+
+        Yields a batch of model input whenever it needs network outputs, and
+        expects the model's [priors, values] to be sent back; returns the
+        chosen move. The search passes, tree creation and evaluation below
+        are generators in the same way, which lets one caller interleave
+        many searches and merge their model inputs into shared batches.
+        """
+        self.stop_pondering()
+        if self.opening_book is not None:
+            entry = self.opening_book.lookup(game_state)
+            if entry is not None:
+                return entry[0]
+
+        stats = self.begin_stats(game_state)
+        table = self.transposition_table
+        if stats is not None and table is not None:
+            hits, misses = table.hits, table.misses
+
+        # the tree was kept by reuse_tree or grown by pondering
+        tree = None
+        if self.tree is not None:
+            tree = self.find_subtree(game_state)
+        if tree is None:
+            tree = ZeroTree()
+            yield from self.create_nodes(tree, [(game_state, -1, -1)], stats)
+        position = SearchPosition(game_state)
+        num_nodes = tree.num_nodes
+
+        budget = SearchBudget(self.num_rounds, int(tree.total_visit_counts[0]) - 1, self.time_budget)
+        while not budget.exhausted():
+            num_leaves = min(self.batch_size, self.num_rounds - budget.rounds)
+            yield from self.search_pass(tree, position, num_leaves, stats)
+            budget.rounds += num_leaves
+            if self.early_stop and budget.decided(tree.visit_counts[0][tree.legal[0]].tolist()):
+                break
 
         if self.collector is not None:
             root_state_tensor = self.encoder.encode(game_state)
-            visit_counts = np.array([root.visit_count(column) for column in range(7)])
+            visit_counts = tree.visit_counts[0].copy()
             # print(visit_counts)
             self.collector.record_decision(root_state_tensor, visit_counts)
 
-        return max(root.moves(), key=root.visit_count)
-
-    def create_node(self, game_state, move=None, parent=None)        :
-        state_tensor = self.encoder.encode(game_state)
-        model_input = np.array([state_tensor])
-        priors, values = self.model.predict(model_input)
-        priors = priors[0]
-        value = values[0][0]
-        move_priors = {
-            column: p
-            for column, p in enumerate(priors)
-        }
-        new_node = ZeroTreeNode(
-            game_state,
-            value,
-            move_priors,
-            parent,
-            move
-        )
-        if parent is not None:
-            parent.add_child(move, new_node)
-        return new_node
-
-    def train(self, experience, learning_rate, batch_size):
-        num_examples = experience.states.shape[0]
-        model_input = experience.states
-        visit_sums = np.sum(experience.visit_counts, axis=1).reshape((num_examples, 1))
-        action_target = experience.visit_counts / visit_sums
-        value_target = experience.rewards
+        self.tree = tree if self.reuse_tree else None
+        move = tree.best_move(0)
+        if stats is not None:
+            stats.nodes = tree.num_nodes - num_nodes
+            stats.root_visits = tree.visit_counts[0].tolist()
+            if table is not None:
+                stats.cache_hits = table.hits - hits
+                stats.cache_misses = table.misses - misses
+        self.end_stats(stats, move)
+        return move
+
+    def search_pass(self, tree, position, num_leaves, stats=None):
+        """Selects num_leaves leaves, evaluates them with one predict and backs them up."""
+        leaves = [self.select_leaf(tree, position, stats) for _ in range(num_leaves)]
+        if stats is not None:
+            stats.lap('selection')
+        yield from self.expand_leaves(tree, leaves, stats)
+
+        for node, move, _ in leaves:
+            value = -1 * float(tree.values[tree.child(node, move)])
+            while node >= 0:
+                tree.remove_virtual_loss(node, move)
+                tree.record_visit(node, move, value)
+                move = int(tree.last_moves[node])
+                node = int(tree.parents[node])
+                value = -1 * value
+        if stats is not None:
+            stats.lap('backup')
+            stats.rounds += num_leaves
+
+    def start_pondering(self, game_state, max_nodes=200000):
+        """Searches game_state in a background thread while the opponent thinks.
+
+        Call it with the position after our move. The next select_move stops
+        the thread and continues from the subtree of the opponent's reply,
+        so the statistics gathered meanwhile are kept. Pondering also ends
+        once the tree holds max_nodes nodes, which bounds its memory use.
+        """
+        self.stop_pondering()
+        if game_state.is_over():
+            return
+        tree = None
+        if self.tree is not None:
+            tree = self.find_subtree(game_state)
+        if tree is None:
+            tree = ZeroTree()
+            self.run(self.create_nodes(tree, [(game_state, -1, -1)]))
+        self.tree = tree
+        self._ponder_stop.clear()
+        self._ponder_thread = threading.Thread(
+            target=self._ponder, args=(tree, SearchPosition(game_state), max_nodes), daemon=True)
+        self._ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stops the pondering thread after its current pass; a no-op if there is none."""
+        if self._ponder_thread is None:
+            return
+        self._ponder_stop.set()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+
+    def _ponder(self, tree, position, max_nodes):
+        while not self._ponder_stop.is_set() and tree.num_nodes < max_nodes:
+            self.run(self.search_pass(tree, position, self.batch_size))
+
+    def find_subtree(self, game_state):
+        tree = self.tree
+        node = find_reusable(0, np.uint64(game_state.position_hash()),
+            lambda node: tree.hashes[node], lambda node: tree.children[node][tree.children[node] >= 0])
+        if node is None:
+            return None
+        # copy it out so the rest of the old tree can be freed
+        return tree.subtree(node)
+
+    def select_leaf(self, tree, position, stats=None):
+        # virtual loss on the path steers later descents of the same pass
+        # away from it until the leaf has been evaluated and backed up
+        node = 0
+        next_move = tree.select_branch(node, self.c)
+        tree.add_virtual_loss(node, next_move)
+        position.play(next_move)
+        while tree.child(node, next_move) >= 0 and not position.is_over():
+            node = tree.child(node, next_move)
+            next_move = tree.select_branch(node, self.c)
+            tree.add_virtual_loss(node, next_move)
+            position.play(next_move)
+
+        new_state = None
+        if tree.child(node, next_move) < 0:
+            new_state = position.to_game_state()
+        if stats is not None:
+            stats.record_depth(len(position.moves))
+        while position.moves:
+            position.undo()
+        return node, next_move, new_state
+
+    def expand_leaves(self, tree, leaves, stats=None):
+        # the same leaf can be reached twice in one pass, expand it once
+        pending = {}
+        for node, move, new_state in leaves:
+            if new_state is not None and (node, move) not in pending:
+                pending[(node, move)] = (new_state, move, node)
+        yield from self.create_nodes(tree, list(pending.values()), stats)
+
+    def create_nodes(self, tree, leaves, stats=None):
+        values = [0.0] * len(leaves)
+        priors = [np.zeros(7)] * len(leaves)
+        evaluated = []
+        for i, (game_state, _, _) in enumerate(leaves):
+            if game_state.is_over():
+                # the player to move has lost or the board is full
+                values[i] = -1.0 if game_state.winner() is not None else 0.0
+            else:
+                evaluated.append(i)
+
+        if evaluated:
+            outputs = yield from self.evaluate([leaves[i][0] for i in evaluated], stats)
+            for i, (move_priors, value) in zip(evaluated, outputs):
+                values[i] = value
+                priors[i] = move_priors
+
+        for (game_state, move, parent), value, move_priors in zip(leaves, values, priors):
+            legal = [game_state.is_valid_move(column) for column in range(7)]
+            tree.add_node(game_state.position_hash(), value, move_priors, legal, parent, move)
+        if stats is not None:
+            stats.lap('expansion')
+
+    def evaluate(self, game_states, stats=None):
+        # a position and its mirror image share one evaluation: the model sees
+        # the canonical form and the priors are flipped back for mirrored states
+        table = self.transposition_table
+        outputs = {}
+        missing = {}
+        for state in game_states:
+            key = state.canonical_hash()
+            if key in outputs or key in missing:
+                continue
+            entry = table.get(key) if table is not None else None
+            if entry is None:
+                missing[key] = state
+            else:
+                outputs[key] = entry
+
+        if missing:
+            if stats is not None:
+                stats.lap('expansion')
+            model_input = self.encode_inputs(list(missing.values()))
+            if stats is not None:
+                stats.lap('encoding')
+            priors, values = yield model_input
+            if stats is not None:
+                stats.lap('inference')
+            for key, p, v in zip(missing, priors, values):
+                outputs[key] = (np.array(p), v[0])
+                if table is not None:
+                    table.put(key, outputs[key])
+
+        results = []
+        for state in game_states:
+            priors, value = outputs[state.canonical_hash()]
+            if state.is_mirrored():
+                priors = priors[::-1]
+            results.append((priors, value))
+        return results
+
+    def encode_inputs(self, game_states):
+        # model inputs are encoded into one buffer that is reused across calls
+        if self._input_buffer is None or len(self._input_buffer) < len(game_states):
+            self._input_buffer = np.zeros(
+                (max(len(game_states), self.batch_size),) + self.encoder.shape(), dtype=np.float32)
+        return self.encoder.encode_batch(game_states, out=self._input_buffer, canonical=True)
+
+    def train(self, experience, learning_rate, batch_size, augment=False):
+        """Trains on a ZeroExperienceBuffer in memory, or streams mini-batches
+        from anything with a batches(batch_size, augment) method, like
+        replay.ReplayBuffer. With augment set, mirrored positions are added.
+        """
+        from keras.optimizers import SGD
 
         self.model.compile(SGD(lr=learning_rate), loss=['categorical_crossentropy', 'mse'])
-        self.model.fit(model_input, [action_target, value_target], batch_size=batch_size)
+        if isinstance(experience, ZeroExperienceBuffer):
+            states, visit_counts, rewards = experience.states, experience.visit_counts, experience.rewards
+            if augment:
+                states, visit_counts, rewards = mirror_experience(states, visit_counts, rewards)
+            self.model.fit(states, [policy_target(visit_counts), rewards], batch_size=batch_size)
+            return
+
+        for states, visit_counts, rewards in experience.batches(batch_size, augment=augment):
+            self.model.train_on_batch(states, [policy_target(visit_counts), rewards])
@@ -0,0 +1,67 @@
+import mmap
+import struct
+
+# File layout: a header followed by fixed-size records sorted by position
+# hash. Values are from the point of view of the player to move, in [-1, 1].
+MAGIC = b'C4BK'
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<QBxxxf')
+VERSION = 1
+
+_KEY = struct.Struct('<Q')
+
+def write_book(path, entries):
+    """Write entries, a dict of position hash -> (move, value), to path."""
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        for key in sorted(entries):
+            move, value = entries[key]
+            f.write(RECORD.pack(key, move, value))
+
+class OpeningBook():
+    """Read-only opening book backed by a memory-mapped file.
+
+    Opening is instant since nothing is parsed up front; lookups binary
+    search the mapped records. Every process that opens the same file
+    shares its pages through the OS page cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_entries = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not an opening book'.format(path))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.num_entries
+
+    def __reduce__(self):
+        # worker processes map the file themselves instead of copying it
+        return (OpeningBook, (self.path,))
+
+    def close(self):
+        self._map.close()
+
+    def _key(self, index):
+        return _KEY.unpack_from(self._map, HEADER.size + index * RECORD.size)[0]
+
+    def lookup(self, game_state):
+        """Returns (move, value) for game_state or None if it is not in the book."""
+        key = game_state.position_hash()
+        low = 0
+        high = self.num_entries
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.num_entries and self._key(low) == key:
+            self.hits += 1
+            _, move, value = RECORD.unpack_from(self._map, HEADER.size + low * RECORD.size)
+            return move, value
+        self.misses += 1
+        return None
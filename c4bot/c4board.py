@@ -1,50 +1,156 @@
-import copy
+import random
 
 from c4bot.c4types import Player
 
+# Bitboard layout: each column occupies 7 bits (6 playable rows plus one
+# sentinel row on top), so cell (x, y) lives at bit x * 7 + y.
+#
+#  5 12 19 26 33 40 47
+#  4 11 18 25 32 39 46
+#  ...
+#  0  7 14 21 28 35 42
+WIDTH = 7
+HEIGHT = 6
+STRIDE = HEIGHT + 1
+
+def bottom_mask(column):
+    return 1 << (column * STRIDE)
+
+def top_mask(column):
+    return 1 << (column * STRIDE + HEIGHT - 1)
+
+def column_mask(column):
+    return ((1 << HEIGHT) - 1) << (column * STRIDE)
+
+BOTTOM_MASK = sum(bottom_mask(column) for column in range(WIDTH))
+TOP_MASK = sum(top_mask(column) for column in range(WIDTH))
+BOARD_MASK = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+
+# maps every free top-row pattern to its playable columns
+FREE_COLUMNS = {}
+for _free in range(1 << WIDTH):
+    _columns = tuple(column for column in range(WIDTH) if _free & (1 << column))
+    FREE_COLUMNS[sum(top_mask(column) for column in _columns)] = _columns
+
+# Zobrist keys per player and bit; the seed is fixed so hashes stay stable
+# across processes and runs
+_zobrist_rng = random.Random(0xc4)
+ZOBRIST = {
+    player: [_zobrist_rng.getrandbits(64) for _ in range(WIDTH * STRIDE)]
+    for player in Player
+}
+# keys of the reflected bits, for hashing the mirror image of a position
+MIRROR_ZOBRIST = {
+    player: [
+        keys[(WIDTH - 1 - bit // STRIDE) * STRIDE + bit % STRIDE]
+        for bit in range(WIDTH * STRIDE)
+    ]
+    for player, keys in ZOBRIST.items()
+}
+
+def mirror(bits):
+    """Reflects a bitboard left to right."""
+    mirrored = 0
+    for column in range(WIDTH):
+        mirrored |= ((bits >> (column * STRIDE)) & 0x7f) << ((WIDTH - 1 - column) * STRIDE)
+    return mirrored
+
+def has_alignment(stones):
+    # vertical, diagonal (\), horizontal and diagonal (/) neighbours
+    for shift in (1, STRIDE - 1, STRIDE, STRIDE + 1):
+        pairs = stones & (stones >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+def winning_cells(stones, mask):
+    """Empty cells that would complete an alignment for stones."""
+    # the shifts hardcode STRIDE == 7; vertical
+    cells = (stones << 1) & (stones << 2) & (stones << 3)
+    # horizontal
+    pair = (stones << 7) & (stones << 14)
+    cells |= pair & ((stones << 21) | (stones >> 7))
+    pair = (stones >> 7) & (stones >> 14)
+    cells |= pair & ((stones << 7) | (stones >> 21))
+    # diagonal (\)
+    pair = (stones << 6) & (stones << 12)
+    cells |= pair & ((stones << 18) | (stones >> 6))
+    pair = (stones >> 6) & (stones >> 12)
+    cells |= pair & ((stones << 6) | (stones >> 18))
+    # diagonal (/)
+    pair = (stones << 8) & (stones << 16)
+    cells |= pair & ((stones << 24) | (stones >> 8))
+    pair = (stones >> 8) & (stones >> 16)
+    cells |= pair & ((stones << 8) | (stones >> 24))
+    return cells & (BOARD_MASK ^ mask)
+
 class Board():
     def __init__(self):
-        self.grid = []
-        for _ in range(6):
-            self.grid.append([None] * 7)
-        self.heights = [0] * 7
+        # position holds the pieces of self.player, mask holds all pieces
+        self.position = 0
+        self.mask = 0
+        self.player = Player.red
+        self.zobrist = 0
+        # hash of the mirror image, kept alongside for canonical keys
+        self.mirror_zobrist = 0
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.position = self.position
+        board.mask = self.mask
+        board.player = self.player
+        board.zobrist = self.zobrist
+        board.mirror_zobrist = self.mirror_zobrist
+        return board
+
+    def mirrored(self):
+        board = Board.__new__(Board)
+        board.position = mirror(self.position)
+        board.mask = mirror(self.mask)
+        board.player = self.player
+        board.zobrist = self.mirror_zobrist
+        board.mirror_zobrist = self.zobrist
+        return board
 
     def get(self, x, y):
         if x < 0 or x > 6 or y < 0 or y > 5:
             return None
-        return self.grid[y][x]
+        bit = 1 << (x * STRIDE + y)
+        if not self.mask & bit:
+            return None
+        return self.player if self.position & bit else self.player.other
+
+    def height(self, column):
+        return ((self.mask >> (column * STRIDE)) & 0x7f).bit_length()
+
+    @property
+    def heights(self):
+        return [self.height(column) for column in range(WIDTH)]
 
     def drop_piece(self, player, column):
-        row = self.heights[column]
-        assert row < 6
-        self.grid[row][column] = player
-        self.heights[column] += 1
+        assert not self.mask & top_mask(column)
+        if player != self.player:
+            self.position ^= self.mask
+        row = self.height(column)
+        # switch sides: the new piece is set in mask but not in position
+        self.position ^= self.mask
+        self.mask |= self.mask + bottom_mask(column)
+        self.player = player.other
+        self.zobrist ^= ZOBRIST[player][column * STRIDE + row]
+        self.mirror_zobrist ^= MIRROR_ZOBRIST[player][column * STRIDE + row]
         return (column, row) # TODO: make namedtuple
 
     def is_full_column(self, column):
-        return self.heights[column] == 6
-
-    def _is_winning_move(self, move, factor_x, factor_y):
-        connected = 0
-        for offset in range(-3, 4):
-            if self.get(move[0] + factor_x * offset, move[1] + factor_y * offset) == self.get(*move):
-                connected += 1
-            else:
-                connected = 0
-            if connected == 4:
-                return True
-        return False
+        return (self.mask & top_mask(column)) != 0
+
+    def free_columns(self):
+        return list(FREE_COLUMNS[~self.mask & TOP_MASK])
+
+    def stones(self, player):
+        return self.position if player == self.player else self.position ^ self.mask
 
     def is_winning_move(self, move):
-        if self._is_winning_move(move, 1, 0):
-            return True
-        if self._is_winning_move(move, 0, 1):
-            return True
-        if self._is_winning_move(move, 1, 1):
-            return True
-        if self._is_winning_move(move, 1, -1):
-            return True
-        return False
+        return has_alignment(self.stones(self.get(*move)))
 
 class GameState():
     def __init__(self, board, next_player, previous, move):
@@ -52,36 +158,124 @@ class GameState():
         self.next_player = next_player
         self.previous_state = previous
         self.last_move = move
+        # terminal status is derived once here, the state never changes
+        self._winner = None
+        if move is not None and board.is_winning_move(move):
+            self._winner = next_player.other
+        self._is_over = self._winner is not None or (board.mask & TOP_MASK) == TOP_MASK
 
     def apply_move(self, column):
-        next_board = copy.deepcopy(self.board)
+        next_board = self.board.copy()
         move = next_board.drop_piece(self.next_player, column)
         return GameState(next_board, self.next_player.other, self, move)
 
+    def position_hash(self):
+        return self.board.zobrist
+
+    def canonical_hash(self):
+        # a position and its mirror image share this key
+        return min(self.board.zobrist, self.board.mirror_zobrist)
+
+    def is_mirrored(self):
+        """True if the canonical form is the mirror image of this position.
+
+        The canonical form is whichever of the two has the lesser hash.
+        """
+        return self.board.mirror_zobrist < self.board.zobrist
+
+    def mirrored(self):
+        move = self.last_move
+        if move is not None:
+            move = (WIDTH - 1 - move[0], move[1])
+        return GameState(self.board.mirrored(), self.next_player, None, move)
+
+    def canonical(self):
+        return self.mirrored() if self.is_mirrored() else self
+
+    def winner(self):
+        return self._winner
+
     def is_over(self):
-        if self.last_move == None:
-            return False
-        if self.board.is_winning_move(self.last_move):
-            return True
-        board_full = True
-        for column in range(7):
-            if not self.board.is_full_column(column):
-                board_full = False
-                break
-        return board_full
-    
+        return self._is_over
+
     def is_valid_move(self, column):
-        if self.is_over():
+        if self._is_over:
             return False
         return not self.board.is_full_column(column)
 
     def legal_moves(self):
-        moves = []
-        for column in range(7):
-            if self.is_valid_move(column):
-                moves.append(column)
-        return moves
+        if self._is_over:
+            return []
+        return self.board.free_columns()
 
     @classmethod
     def new_game(cls):
         return GameState(Board(), Player.red, None, None)
+
+class SearchPosition():
+    """Mutable position for tree search.
+
+    play() and undo() update two ints and a move stack in place, so a
+    search can walk down and back up without creating GameStates.
+    """
+    def __init__(self, game_state):
+        board = game_state.board
+        self.current = board.stones(game_state.next_player)
+        self.mask = board.mask
+        self.next_player = game_state.next_player
+        self.zobrist = board.zobrist
+        self.mirror_zobrist = board.mirror_zobrist
+        self.moves = []
+        self._winner = game_state.winner()
+        self._root_move = game_state.last_move
+
+    def play(self, column):
+        bit = (self.mask + bottom_mask(column)) & column_mask(column)
+        self.zobrist ^= ZOBRIST[self.next_player][bit.bit_length() - 1]
+        self.mirror_zobrist ^= MIRROR_ZOBRIST[self.next_player][bit.bit_length() - 1]
+        self.current ^= self.mask
+        self.mask |= self.mask + bottom_mask(column)
+        self.next_player = self.next_player.other
+        self.moves.append(column)
+        if has_alignment(self.current ^ self.mask):
+            self._winner = self.next_player.other
+
+    def undo(self):
+        column = self.moves.pop()
+        top = (self.mask & column_mask(column)).bit_length() - 1
+        self.mask ^= 1 << top
+        self.current ^= self.mask
+        self.next_player = self.next_player.other
+        self.zobrist ^= ZOBRIST[self.next_player][top]
+        self.mirror_zobrist ^= MIRROR_ZOBRIST[self.next_player][top]
+        self._winner = None
+
+    def position_hash(self):
+        return self.zobrist
+
+    def canonical_hash(self):
+        return min(self.zobrist, self.mirror_zobrist)
+
+    def winner(self):
+        return self._winner
+
+    def is_over(self):
+        return self._winner is not None or (self.mask & TOP_MASK) == TOP_MASK
+
+    def legal_moves(self):
+        if self.is_over():
+            return ()
+        return FREE_COLUMNS[~self.mask & TOP_MASK]
+
+    def to_game_state(self):
+        board = Board.__new__(Board)
+        board.position = self.current
+        board.mask = self.mask
+        board.player = self.next_player
+        board.zobrist = self.zobrist
+        board.mirror_zobrist = self.mirror_zobrist
+        last_move = self._root_move
+        if self.moves:
+            column = self.moves[-1]
+            last_move = (column, board.height(column) - 1)
+        return GameState(board, self.next_player, None, last_move)
@@ -0,0 +1,137 @@
+import math
+
+ACCEPT = 'accept'
+REJECT = 'reject'
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def elo_difference(score):
+    # clamped so that all wins or all losses give a finite, large difference
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+class SPRT():
+    """Sequential probability ratio test on a stream of game results.
+
+    Tests whether a player is elo1 stronger than its opponent (accept)
+    rather than elo0 (reject), with error rates alpha and beta. Scores are
+    1 for a win, 0.5 for a draw and 0 for a loss, and the log-likelihood
+    ratio uses the normal approximation of the mean score.
+    """
+    def __init__(self, elo0=0, elo1=35, alpha=0.05, beta=0.05, min_games=10):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        # a handful of games has too little variance to trust the ratio
+        self.min_games = min_games
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    @property
+    def num_games(self):
+        return self.wins + self.draws + self.losses
+
+    def record(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def score(self):
+        if self.num_games == 0:
+            return 0.5
+        return (self.wins + 0.5 * self.draws) / self.num_games
+
+    def variance(self):
+        # variance of a single game's score
+        if self.num_games == 0:
+            return 0.0
+        score = self.score()
+        return (
+            self.wins * (1 - score) ** 2
+            + self.draws * (0.5 - score) ** 2
+            + self.losses * score ** 2
+        ) / self.num_games
+
+    def llr(self):
+        variance = max(self.variance(), 1e-6)
+        score0 = expected_score(self.elo0)
+        score1 = expected_score(self.elo1)
+        return self.num_games * (score1 - score0) * (2 * self.score() - score0 - score1) / (2 * variance)
+
+    def status(self):
+        """Returns ACCEPT, REJECT, or None while more games are needed."""
+        if self.num_games < self.min_games:
+            return None
+        llr = self.llr()
+        if llr >= self.upper:
+            return ACCEPT
+        if llr <= self.lower:
+            return REJECT
+        return None
+
+    def elo(self, z=1.96):
+        """Returns the Elo estimate and the bounds of its confidence interval."""
+        score = self.score()
+        margin = z * math.sqrt(self.variance() / max(self.num_games, 1))
+        return (
+            elo_difference(score),
+            elo_difference(score - margin),
+            elo_difference(score + margin),
+        )
+
+    def report(self):
+        elo, low, high = self.elo()
+        return '+{} ={} -{}, Elo {:.0f} [{:.0f}, {:.0f}], LLR {:.2f} ({:.2f}, {:.2f})'.format(
+            self.wins, self.draws, self.losses, elo, low, high, self.llr(), self.lower, self.upper)
+
+def fit_ratings(results, prior=2.0, iterations=50):
+    """Fits Elo ratings to game results by maximum likelihood.
+
+    results holds (player, opponent, score) tuples with the score of player.
+    As in BayesElo, every player also gets prior virtual draws against an
+    opponent rated 0, which keeps the ratings of unbeaten players finite.
+    Returns a dict of player -> (rating, standard error), with ratings
+    shifted to average 0.
+    """
+    import numpy as np
+
+    players = sorted({name for result in results for name in result[:2]})
+    index = {name: i for i, name in enumerate(players)}
+    num_players = len(players)
+    games = np.zeros((num_players, num_players))
+    scores = np.zeros((num_players, num_players))
+    for player, opponent, score in results:
+        i, j = index[player], index[opponent]
+        games[i, j] += 1
+        games[j, i] += 1
+        scores[i, j] += score
+        scores[j, i] += 1 - score
+
+    # natural units: p = 1 / (1 + exp(-(r_i - r_j)))
+    scale = 400 / math.log(10)
+    ratings = np.zeros(num_players)
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(ratings[np.newaxis, :] - ratings[:, np.newaxis]))
+        p_prior = 1 / (1 + np.exp(-ratings))
+        gradient = (scores - games * p).sum(axis=1) + prior * (0.5 - p_prior)
+        weights = games * p * (1 - p)
+        hessian = weights - np.diag(weights.sum(axis=1) + prior * p_prior * (1 - p_prior))
+        step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+        ratings -= step
+        if np.abs(step).max() < 1e-9:
+            break
+
+    # errors of the ratings relative to the average, not to the prior's anchor
+    center = np.eye(num_players) - 1 / num_players
+    covariance = center @ np.linalg.pinv(-hessian) @ center
+    errors = np.sqrt(np.maximum(np.diag(covariance), 0))
+    ratings -= ratings.mean()
+    return {
+        name: (float(ratings[i] * scale), float(errors[i] * scale)) for name, i in index.items()
+    }
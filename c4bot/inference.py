@@ -0,0 +1,167 @@
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from c4bot.agent.zero import ZeroEncoder
+
+_client = None
+
+def _float_view(raw, shape):
+    return np.frombuffer(raw, dtype=np.float32).reshape(shape)
+
+class InferenceConnection():
+    """Shared-memory slots and queues that link workers to the server.
+
+    Each worker process claims one slot: a buffer for its input tensors and
+    buffers for the matching priors and values. Requests only carry the slot
+    id, the model name and the number of rows, and the server wakes the
+    worker through the slot's semaphore once the outputs are written. Pass
+    it to worker processes at creation, e.g. as Pool initargs.
+    """
+    def __init__(self, num_slots, slot_size, input_shape):
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.input_shape = (slot_size,) + tuple(input_shape)
+        self.requests = multiprocessing.Queue()
+        self.free_slots = multiprocessing.Queue()
+        self.inputs = []
+        self.priors = []
+        self.values = []
+        self.ready = []
+        for slot in range(num_slots):
+            self.inputs.append(multiprocessing.RawArray('f', int(np.prod(self.input_shape))))
+            self.priors.append(multiprocessing.RawArray('f', slot_size * 7))
+            self.values.append(multiprocessing.RawArray('f', slot_size))
+            self.ready.append(multiprocessing.Semaphore(0))
+            self.free_slots.put(slot)
+
+class InferenceClient():
+    def __init__(self, connection):
+        self.connection = connection
+        self.slot = connection.free_slots.get()
+        self.inputs = _float_view(connection.inputs[self.slot], connection.input_shape)
+        self.priors = _float_view(connection.priors[self.slot], (connection.slot_size, 7))
+        self.values = _float_view(connection.values[self.slot], (connection.slot_size, 1))
+
+    def predict(self, model_name, model_input):
+        slot_size = self.connection.slot_size
+        priors = []
+        values = []
+        for start in range(0, len(model_input), slot_size):
+            rows = model_input[start:start + slot_size]
+            self.inputs[:len(rows)] = rows
+            self.connection.requests.put((self.slot, model_name, len(rows)))
+            self.connection.ready[self.slot].acquire()
+            priors.append(self.priors[:len(rows)].copy())
+            values.append(self.values[:len(rows)].copy())
+        return np.concatenate(priors), np.concatenate(values)
+
+class RemoteModel():
+    """Stands in for a Keras model in ZeroAgent; predict runs on the server."""
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def predict(self, model_input, batch_size=None):
+        return self.client.predict(self.name, model_input)
+
+def connect(connection):
+    """Pool initializer: claims a slot for this worker process."""
+    global _client
+    _client = InferenceClient(connection)
+
+def remote_model(name):
+    return RemoteModel(_client, name)
+
+def _serve(load_models, connection, max_batch_size, max_latency, report_interval, results):
+    models = load_models()
+    slot_size = connection.slot_size
+    inputs = [_float_view(raw, connection.input_shape) for raw in connection.inputs]
+    priors_out = [_float_view(raw, (slot_size, 7)) for raw in connection.priors]
+    values_out = [_float_view(raw, (slot_size, 1)) for raw in connection.values]
+    stats = {'requests': 0, 'rows': 0, 'batches': 0, 'fill': 0.0}
+    start = time.time()
+    last_report = start
+    running = True
+    while running:
+        request = connection.requests.get()
+        if request is None:
+            break
+        pending = [request]
+        num_rows = request[2]
+        deadline = time.time() + max_latency
+        while num_rows < max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = connection.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                running = False
+                break
+            pending.append(request)
+            num_rows += request[2]
+
+        for name, model in models.items():
+            batch = [(slot, rows) for slot, model_name, rows in pending if model_name == name]
+            if not batch:
+                continue
+            model_input = np.concatenate([inputs[slot][:rows] for slot, rows in batch])
+            priors, values = model.predict(model_input, batch_size=len(model_input))
+            offset = 0
+            for slot, rows in batch:
+                priors_out[slot][:rows] = priors[offset:offset + rows]
+                values_out[slot][:rows] = values[offset:offset + rows]
+                offset += rows
+                connection.ready[slot].release()
+            stats['batches'] += 1
+            stats['rows'] += len(model_input)
+            stats['fill'] += len(model_input) / max_batch_size
+        stats['requests'] += len(pending)
+
+        if report_interval and time.time() - last_report > report_interval:
+            last_report = time.time()
+            print('Inference: ' + format_stats(stats, last_report - start))
+
+    stats['seconds'] = time.time() - start
+    results.put(stats)
+
+def format_stats(stats, seconds):
+    batches = max(stats['batches'], 1)
+    return '{} requests, {} batches, {:.0f} evals/s, {:.1f} rows/batch, {:.1%} batch fill'.format(
+        stats['requests'], stats['batches'], stats['rows'] / max(seconds, 1e-9),
+        stats['rows'] / batches, stats['fill'] / batches)
+
+class InferenceServer():
+    """Process that owns the models and batches requests from all workers.
+
+    load_models runs in the server process and returns a dict of model name
+    to model, so the framework is only imported there. A batch is sent to
+    predict once it holds max_batch_size rows or the first request in it
+    has waited max_latency seconds.
+    """
+    def __init__(self, load_models, num_slots, slot_size=64, max_batch_size=256,
+                 max_latency=0.002, report_interval=30, input_shape=None):
+        if input_shape is None:
+            input_shape = ZeroEncoder().shape()
+        self.connection = InferenceConnection(num_slots, slot_size, input_shape)
+        self._results = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(load_models, self.connection, max_batch_size, max_latency,
+                  report_interval, self._results)
+        )
+
+    def start(self):
+        self._process.start()
+
+    def stop(self):
+        self.connection.requests.put(None)
+        stats = self._results.get()
+        self._process.join()
+        print('Inference: ' + format_stats(stats, stats['seconds']))
+        return stats
@@ -0,0 +1,255 @@
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Exported models are .npz files: a JSON layer graph stored as bytes under
+# 'graph', plus one float32 array per weight under '<layer>/<weight>'.
+# Tensors are kept channels last inside the engine; the exporter rewrites
+# weights so that channels first models need only one transpose of their
+# input.
+FORMAT_VERSION = 1
+
+ACTIVATIONS = ('linear', 'relu', 'tanh', 'sigmoid', 'softmax')
+
+def _activate(x, activation):
+    # in place where possible, x is always a fresh array
+    if activation == 'relu':
+        np.maximum(x, 0, out=x)
+    elif activation == 'tanh':
+        np.tanh(x, out=x)
+    elif activation == 'sigmoid':
+        x = 1 / (1 + np.exp(-x))
+    elif activation == 'softmax':
+        x -= x.max(axis=-1, keepdims=True)
+        np.exp(x, out=x)
+        x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+class NumpyModel():
+    """Forward pass of an exported Keras model in NumPy, without TensorFlow.
+
+    Stands in for the Keras model in ZeroAgent: predict takes the same
+    input and returns one array per model output. Convolutions run as one
+    im2col matrix product each, with bias and activation applied in place.
+    """
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            graph = json.loads(bytes(data['graph']).decode('utf-8'))
+            self.weights = {key: data[key] for key in data.files if key != 'graph'}
+        if graph['version'] != FORMAT_VERSION:
+            raise ValueError('{} has model format {}, expected {}'.format(
+                path, graph['version'], FORMAT_VERSION))
+        self.input_name = graph['input']
+        self.channels_first = graph['channels_first']
+        self.layers = graph['layers']
+        self.outputs = graph['outputs']
+        # index of the last layer that reads each tensor, so it can be freed
+        self._last_use = {}
+        for i, layer in enumerate(self.layers):
+            for name in layer['inputs']:
+                self._last_use[name] = i
+
+    def predict(self, model_input, batch_size=None):
+        x = np.asarray(model_input, dtype=np.float32)
+        if self.channels_first:
+            x = x.transpose(0, 2, 3, 1)
+        tensors = {self.input_name: x}
+        for i, layer in enumerate(self.layers):
+            inputs = [tensors[name] for name in layer['inputs']]
+            tensors[layer['name']] = getattr(self, '_' + layer['type'])(layer, *inputs)
+            for name in layer['inputs']:
+                if self._last_use[name] == i and name not in self.outputs:
+                    del tensors[name]
+        return [tensors[name] for name in self.outputs]
+
+    def _conv(self, layer, x):
+        kernel = self.weights[layer['name'] + '/kernel']
+        kernel_height, kernel_width = layer['kernel_size']
+        num_rows = x.shape[0]
+        if kernel_height == 1 and kernel_width == 1:
+            height, width = x.shape[1:3]
+            columns = x.reshape(-1, x.shape[3])
+        else:
+            if layer['padding'] == 'same':
+                x = np.pad(x, (
+                    (0, 0),
+                    ((kernel_height - 1) // 2, kernel_height // 2),
+                    ((kernel_width - 1) // 2, kernel_width // 2),
+                    (0, 0),
+                ))
+            # (rows, height, width, channels, kernel_height, kernel_width),
+            # a read only view; reshaping it below makes the copy
+            height = x.shape[1] - kernel_height + 1
+            width = x.shape[2] - kernel_width + 1
+            row_stride, height_stride, width_stride, channel_stride = x.strides
+            windows = as_strided(
+                x, shape=(num_rows, height, width, x.shape[3], kernel_height, kernel_width),
+                strides=(row_stride, height_stride, width_stride, channel_stride,
+                         height_stride, width_stride),
+                writeable=False)
+            columns = windows.reshape(num_rows * height * width, -1)
+        out = columns @ kernel
+        if layer['name'] + '/bias' in self.weights:
+            out += self.weights[layer['name'] + '/bias']
+        out = _activate(out, layer['activation'])
+        return out.reshape(num_rows, height, width, -1)
+
+    def _dense(self, layer, x):
+        out = x @ self.weights[layer['name'] + '/kernel']
+        if layer['name'] + '/bias' in self.weights:
+            out += self.weights[layer['name'] + '/bias']
+        return _activate(out, layer['activation'])
+
+    def _scale(self, layer, x):
+        # a batch normalization that could not be folded into a layer
+        return x * self.weights[layer['name'] + '/scale'] + self.weights[layer['name'] + '/shift']
+
+    def _activation(self, layer, x):
+        return _activate(x.copy(), layer['activation'])
+
+    def _flatten(self, layer, x):
+        return x.reshape(x.shape[0], -1)
+
+    def _add(self, layer, *inputs):
+        out = inputs[0] + inputs[1]
+        for x in inputs[2:]:
+            out += x
+        return out
+
+def _inbound(layer_config):
+    nodes = layer_config['inbound_nodes']
+    if not nodes:
+        return []
+    return [inbound[0] for inbound in nodes[0]]
+
+def export_model(model, path, fuse=True):
+    """Writes a Keras model to path in the format NumpyModel reads.
+
+    Supports Conv2D with stride 1, Dense, Flatten, Activation, Add and
+    BatchNormalization layers. With fuse set, batch normalizations and
+    activations that follow a linear convolution or dense layer are folded
+    into its weights.
+    """
+    config = model.get_config()
+    if len(config['input_layers']) != 1:
+        raise ValueError('only models with a single input can be exported')
+    input_name = config['input_layers'][0][0]
+    layer_configs = [layer for layer in config['layers'] if layer['class_name'] != 'InputLayer']
+    consumers = {}
+    for layer in layer_configs:
+        for name in _inbound(layer):
+            consumers[name] = consumers.get(name, 0) + 1
+
+    layers = []
+    weights = {}
+    by_name = {}
+    # tensors whose channels first layout the engine stores channels last
+    channels_first_tensors = set()
+    renamed = {}
+    input_channels_first = False
+
+    for layer_config in layer_configs:
+        class_name = layer_config['class_name']
+        layer_config_values = layer_config['config']
+        name = layer_config['name']
+        inputs = [renamed.get(inbound, inbound) for inbound in _inbound(layer_config)]
+        params = model.get_layer(name).get_weights()
+        previous = by_name.get(inputs[0]) if len(inputs) == 1 else None
+        fusable = (
+            fuse and previous is not None and previous['type'] in ('conv', 'dense')
+            and previous['activation'] == 'linear' and consumers.get(inputs[0], 0) == 1
+        )
+
+        if class_name == 'Conv2D':
+            if tuple(layer_config_values['strides']) != (1, 1) or \
+                    tuple(layer_config_values.get('dilation_rate', (1, 1))) != (1, 1):
+                raise ValueError('{}: only stride 1 convolutions are supported'.format(name))
+            channels_first = layer_config_values['data_format'] == 'channels_first'
+            if channels_first and inputs[0] == input_name:
+                input_channels_first = True
+            kernel = params[0]
+            kernel_height, kernel_width, num_channels, num_filters = kernel.shape
+            # im2col columns are ordered (channel, kernel row, kernel column)
+            weights[name + '/kernel'] = kernel.transpose(2, 0, 1, 3).reshape(-1, num_filters)
+            if layer_config_values['use_bias']:
+                weights[name + '/bias'] = params[1]
+            layer = {
+                'type': 'conv', 'kernel_size': [kernel_height, kernel_width],
+                'padding': layer_config_values['padding'],
+                'activation': layer_config_values['activation'],
+            }
+            if channels_first:
+                channels_first_tensors.add(name)
+        elif class_name == 'Dense':
+            kernel = params[0]
+            source = by_name.get(inputs[0])
+            if source is not None and source.get('from_channels_first'):
+                # the engine flattened (height, width, channel), Keras (channel, height, width)
+                num_channels, height, width = source['from_channels_first']
+                kernel = kernel.reshape(num_channels, height, width, -1).transpose(1, 2, 0, 3)
+                kernel = kernel.reshape(num_channels * height * width, -1)
+            weights[name + '/kernel'] = kernel
+            if layer_config_values['use_bias']:
+                weights[name + '/bias'] = params[1]
+            layer = {'type': 'dense', 'activation': layer_config_values['activation']}
+        elif class_name == 'Flatten':
+            layer = {'type': 'flatten'}
+            keras_reorders = layer_config_values.get('data_format') == 'channels_first'
+            if inputs[0] in channels_first_tensors and not keras_reorders:
+                layer['from_channels_first'] = list(model.get_layer(name).input_shape[1:])
+        elif class_name == 'Activation':
+            activation = layer_config_values['activation']
+            if fusable:
+                previous['activation'] = activation
+                renamed[name] = inputs[0]
+                continue
+            layer = {'type': 'activation', 'activation': activation}
+        elif class_name == 'BatchNormalization':
+            gamma, beta, mean, variance = _batch_norm_params(layer_config_values, params)
+            scale = gamma / np.sqrt(variance + layer_config_values['epsilon'])
+            shift = beta - mean * scale
+            if fusable:
+                previous_name = inputs[0]
+                weights[previous_name + '/kernel'] = weights[previous_name + '/kernel'] * scale
+                bias = weights.get(previous_name + '/bias', np.zeros_like(shift))
+                weights[previous_name + '/bias'] = bias * scale + shift
+                renamed[name] = inputs[0]
+                continue
+            weights[name + '/scale'] = scale
+            weights[name + '/shift'] = shift
+            layer = {'type': 'scale'}
+        elif class_name == 'Add':
+            layer = {'type': 'add'}
+        else:
+            raise ValueError('{}: {} layers are not supported'.format(name, class_name))
+
+        if layer.get('activation', 'linear') not in ACTIVATIONS:
+            raise ValueError('{}: activation {} is not supported'.format(name, layer['activation']))
+        if class_name in ('Activation', 'BatchNormalization', 'Add') and \
+                any(inbound in channels_first_tensors for inbound in inputs):
+            channels_first_tensors.add(name)
+        layer['name'] = name
+        layer['inputs'] = inputs
+        layers.append(layer)
+        by_name[name] = layer
+
+    graph = {
+        'version': FORMAT_VERSION,
+        'input': input_name,
+        'channels_first': input_channels_first,
+        'layers': layers,
+        'outputs': [renamed.get(output[0], output[0]) for output in config['output_layers']],
+    }
+    arrays = {key: np.asarray(value, dtype=np.float32) for key, value in weights.items()}
+    arrays['graph'] = np.frombuffer(json.dumps(graph).encode('utf-8'), dtype=np.uint8)
+    np.savez(path, **arrays)
+
+def _batch_norm_params(config, params):
+    # gamma and beta are left out of the weights when scale or center is off
+    params = list(params)
+    gamma = params.pop(0) if config['scale'] else np.ones_like(params[-1])
+    beta = params.pop(0) if config['center'] else np.zeros_like(params[-1])
+    mean, variance = params
+    return gamma, beta, mean, variance
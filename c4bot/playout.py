@@ -0,0 +1,62 @@
+import random
+
+from c4bot.c4board import BOARD_MASK, BOTTOM_MASK, SearchPosition, winning_cells
+
+# Rollout policies play a game to the end from a GameState and return the
+# winner, or None for a draw. MCTSAgent takes one as its rollout_policy.
+
+def uniform_rollout(game_state):
+    """Every legal move is equally likely."""
+    position = SearchPosition(game_state)
+    while not position.is_over():
+        position.play(random.choice(position.legal_moves()))
+    return position.winner()
+
+def _bits(moves):
+    bits = []
+    while moves:
+        low = moves & -moves
+        bits.append(low)
+        moves ^= low
+    return bits
+
+def tactical_rollout(game_state):
+    """Wins if it can, else blocks a win of the opponent, else plays a
+    random move that does not let the opponent win on top of it.
+
+    Works on the raw bitboards like SolverAgent: threats are the empty
+    cells winning_cells finds for each side, and moves are the lowest free
+    cell of every column, so each ply costs a few dozen integer operations.
+    """
+    if game_state.is_over():
+        return game_state.winner()
+    player = game_state.next_player
+    board = game_state.board
+    current = board.stones(player)
+    mask = board.mask
+    while True:
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        if not possible:
+            return None
+        if winning_cells(current, mask) & possible:
+            return player
+        threats = winning_cells(current ^ mask, mask)
+        forced = possible & threats
+        if forced:
+            if forced & (forced - 1):
+                # two threats cannot both be blocked
+                return player.other
+            move = forced
+        else:
+            # a move right below an opponent threat lets them play it
+            safe = possible & ~(threats >> 1)
+            move = random.choice(_bits(safe or possible))
+        # a move that is not a winning cell never ends the game with a win
+        current ^= mask
+        mask |= move
+        player = player.other
+
+ROLLOUT_POLICIES = {
+    'uniform': uniform_rollout,
+    'tactical': tactical_rollout,
+}
@@ -0,0 +1,155 @@
+import glob
+import os
+import random
+import time
+
+import h5py
+import numpy as np
+
+from c4bot.agent.zero import mirror_experience
+
+# Shards use the same 'experience' group layout as
+# ZeroExperienceBuffer.serialize, with states stored as uint8 planes.
+SHARD_SUFFIX = '.h5'
+PART_SUFFIX = '.part'
+
+class ShardWriter():
+    """Appends episodes to chunked, compressed HDF5 shards.
+
+    A shard is written under a temporary name and renamed once it holds
+    shard_size positions or the writer is closed, so readers only ever see
+    complete shards. File names start with the creation time, which keeps
+    them in age order.
+    """
+    def __init__(self, directory, name, shard_size=4096):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.shard_size = shard_size
+        self._file = None
+        self._path = None
+        self._num_shards = 0
+
+    def append(self, states, visit_counts, rewards):
+        if self._file is None:
+            self._open(np.shape(states)[1:])
+        experience = self._file['experience']
+        start = experience['states'].shape[0]
+        end = start + len(states)
+        for name, data in (('states', states), ('visit_counts', visit_counts), ('rewards', rewards)):
+            experience[name].resize(end, axis=0)
+            experience[name][start:end] = data
+        if end >= self.shard_size:
+            self.close()
+
+    def _open(self, state_shape):
+        filename = '{:017.6f}-{}-{}{}'.format(time.time(), self.name, self._num_shards, SHARD_SUFFIX)
+        self._path = os.path.join(self.directory, filename)
+        self._file = h5py.File(self._path + PART_SUFFIX, 'w')
+        self._num_shards += 1
+        experience = self._file.create_group('experience')
+        chunk = min(self.shard_size, 256)
+        experience.create_dataset(
+            'states', shape=(0,) + tuple(state_shape), maxshape=(None,) + tuple(state_shape),
+            chunks=(chunk,) + tuple(state_shape), dtype='uint8', compression='gzip')
+        experience.create_dataset(
+            'visit_counts', shape=(0, 7), maxshape=(None, 7), chunks=(chunk, 7),
+            dtype='int32', compression='gzip')
+        experience.create_dataset(
+            'rewards', shape=(0,), maxshape=(None,), chunks=(chunk,),
+            dtype='float32', compression='gzip')
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        os.rename(self._path + PART_SUFFIX, self._path)
+        self._file = None
+
+class ReplayCollector():
+    """Drop-in for ZeroExperienceCollector that streams episodes to a ShardWriter."""
+    def __init__(self, writer):
+        self.writer = writer
+        self.num_positions = 0
+        self._current_episode_states = []
+        self._current_episode_visit_counts = []
+
+    def begin_episode(self):
+        self._current_episode_states = []
+        self._current_episode_visit_counts = []
+
+    def record_decision(self, state, visit_counts):
+        self._current_episode_states.append(state)
+        self._current_episode_visit_counts.append(visit_counts)
+
+    def complete_episode(self, reward):
+        num_states = len(self._current_episode_states)
+        if num_states == 0:
+            return
+        self.writer.append(
+            np.array(self._current_episode_states, dtype=np.uint8),
+            np.array(self._current_episode_visit_counts, dtype=np.int32),
+            np.full(num_states, reward, dtype=np.float32)
+        )
+        self.num_positions += num_states
+        self.begin_episode()
+
+class ReplayBuffer():
+    """Sliding window over the newest capacity positions of a shard directory.
+
+    refresh() deletes shards that fell out of the window. batches() streams
+    shuffled mini-batches, holding only shuffle_shards shards in memory at a
+    time, so memory use does not grow with the amount of self-play.
+    """
+    def __init__(self, directory, capacity, shuffle_shards=4):
+        self.directory = directory
+        self.capacity = capacity
+        self.shuffle_shards = shuffle_shards
+        self.shards = []
+        self._sizes = {}
+        self.refresh()
+
+    def __len__(self):
+        return sum(self._sizes[path] for path in self.shards)
+
+    def refresh(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*' + SHARD_SUFFIX)))
+        kept = []
+        num_positions = 0
+        for path in reversed(paths):
+            if num_positions >= self.capacity:
+                os.remove(path)
+                self._sizes.pop(path, None)
+                continue
+            if path not in self._sizes:
+                with h5py.File(path, 'r') as h5file:
+                    self._sizes[path] = h5file['experience']['rewards'].shape[0]
+            num_positions += self._sizes[path]
+            kept.append(path)
+        self.shards = kept[::-1]
+
+    def batches(self, batch_size, augment=False):
+        """Yields (states, visit_counts, rewards) mini-batches in random order.
+
+        With augment set, every position is also served as its mirror image.
+        """
+        shards = list(self.shards)
+        random.shuffle(shards)
+        for start in range(0, len(shards), self.shuffle_shards):
+            states = []
+            visit_counts = []
+            rewards = []
+            for path in shards[start:start + self.shuffle_shards]:
+                with h5py.File(path, 'r') as h5file:
+                    states.append(h5file['experience']['states'][()])
+                    visit_counts.append(h5file['experience']['visit_counts'][()])
+                    rewards.append(h5file['experience']['rewards'][()])
+            states = np.concatenate(states)
+            visit_counts = np.concatenate(visit_counts)
+            rewards = np.concatenate(rewards)
+            if augment:
+                states, visit_counts, rewards = mirror_experience(states, visit_counts, rewards)
+            order = np.random.permutation(len(states))
+            for i in range(0, len(order), batch_size):
+                batch = order[i:i + batch_size]
+                yield states[batch].astype(np.float32), visit_counts[batch], rewards[batch]
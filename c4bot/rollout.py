@@ -0,0 +1,53 @@
+import numpy as np
+
+from c4bot.c4board import STRIDE, TOP_MASK, WIDTH, bottom_mask, top_mask
+
+_SHIFTS = [np.uint64(shift) for shift in (1, STRIDE - 1, STRIDE, STRIDE + 1)]
+_TOP_MASK = np.uint64(TOP_MASK)
+_TOPS = np.array([top_mask(column) for column in range(WIDTH)], dtype=np.uint64)
+_BOTTOMS = np.array([bottom_mask(column) for column in range(WIDTH)], dtype=np.uint64)
+
+def has_alignment(stones):
+    won = np.zeros(stones.shape, dtype=bool)
+    for shift in _SHIFTS:
+        pairs = stones & (stones >> shift)
+        won |= (pairs & (pairs >> (shift + shift))) != 0
+    return won
+
+def batch_rollouts(game_state, num_games):
+    """Play num_games uniformly random games from game_state at once.
+
+    Every game in the batch is a pair of uint64 bitboards, laid out like
+    c4board.Board. All games advance one ply per step, so the player to
+    move is the same across the batch, and finished games are dropped from
+    the arrays. Returns win counts keyed like MCTSNode.win_counts.
+    """
+    win_counts = {None: 0, game_state.next_player: 0, game_state.next_player.other: 0}
+    if game_state.is_over():
+        win_counts[game_state.winner()] += num_games
+        return win_counts
+
+    board = game_state.board
+    current = np.full(num_games, board.stones(game_state.next_player), dtype=np.uint64)
+    mask = np.full(num_games, board.mask, dtype=np.uint64)
+    player = game_state.next_player
+
+    while current.size > 0:
+        # uniform choice among free columns: argmax of random weights
+        free = (mask[:, np.newaxis] & _TOPS) == 0
+        weights = np.where(free, np.random.random_sample(free.shape), -1.0)
+        columns = weights.argmax(axis=1)
+        current ^= mask
+        mask |= mask + _BOTTOMS[columns]
+
+        won = has_alignment(current ^ mask)
+        full = (mask & _TOP_MASK) == _TOP_MASK
+        win_counts[player] += int(np.count_nonzero(won))
+        win_counts[None] += int(np.count_nonzero(full & ~won))
+
+        running = ~(won | full)
+        current = current[running]
+        mask = mask[running]
+        player = player.other
+
+    return win_counts
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from c4bot import c4board
+from c4bot import c4types
+from c4bot.agent import registry
+
+# Line protocol over TCP: each request and each response is one JSON object
+# on its own line, and every connection hosts one game session.
+#
+#   {"cmd": "new", "color": "yellow"}   start a game, the client plays color
+#   {"cmd": "move", "column": 3}        play a move, the bot replies
+#   {"cmd": "stats"}                    server counters
+#
+# Game responses hold the moves so far and, once the game is over, the
+# winner: "red", "yellow" or "draw". After a bot move they also hold the
+# move and the seconds the bot thought. Bad requests get {"error": message}.
+
+class InferenceBatcher():
+    """Merges the model inputs of all searching sessions into shared predicts.
+
+    Searches await predict(). The flush task only runs after every task
+    that was ready before it, so by then each session with work to do has
+    submitted its leaves, and a flush answers them all with one predict
+    per max_batch_size rows. Create it inside the running event loop.
+    """
+    def __init__(self, model, max_batch_size=256):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.num_batches = 0
+        self.num_rows = 0
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._flush_forever())
+
+    async def predict(self, model_input):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((model_input, future))
+        self._wakeup.set()
+        return await future
+
+    async def _flush_forever(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, []
+            batch = []
+            num_rows = 0
+            for request in pending:
+                if batch and num_rows + len(request[0]) > self.max_batch_size:
+                    self._predict(batch)
+                    batch = []
+                    num_rows = 0
+                batch.append(request)
+                num_rows += len(request[0])
+            if batch:
+                self._predict(batch)
+
+    def _predict(self, batch):
+        # the inputs are views of the agents' buffers, which stay untouched
+        # until the agents get their outputs
+        model_input = np.concatenate([rows for rows, _ in batch])
+        try:
+            priors, values = self.model.predict(model_input, batch_size=len(model_input))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.num_batches += 1
+        self.num_rows += len(model_input)
+        start = 0
+        for rows, future in batch:
+            end = start + len(rows)
+            if not future.done():
+                future.set_result((priors[start:end], values[start:end]))
+            start = end
+
+    def close(self):
+        self._task.cancel()
+
+async def think(bot, game_state, batcher):
+    """select_move as a cooperative task, with the inference on batcher.
+
+    The agent checks its time budget after every search pass, so under load
+    a move can overrun it by one round of batched inference. Agents without
+    a select_move_steps generator, such as MCTSAgent, search in one piece
+    and hold up the other sessions meanwhile.
+    """
+    if not hasattr(bot, 'select_move_steps'):
+        return bot.select_move(game_state)
+    steps = bot.select_move_steps(game_state)
+    outputs = None
+    try:
+        while True:
+            model_input = steps.send(outputs)
+            outputs = await batcher.predict(model_input)
+    except StopIteration as stop:
+        return stop.value
+
+class Session():
+    def __init__(self, bot, human):
+        self.bot = bot
+        self.human = human
+        self.game = c4board.GameState.new_game()
+        self.moves = []
+
+    def play(self, column):
+        self.game = self.game.apply_move(column)
+        self.moves.append(column)
+
+    def to_dict(self):
+        state = {'moves': self.moves, 'next': self.game.next_player.name}
+        if self.game.is_over():
+            winner = self.game.winner()
+            state['winner'] = 'draw' if winner is None else winner.name
+        return state
+
+class GameServer():
+    """Hosts one game session per connection against agents built from spec."""
+    def __init__(self, spec, max_batch_size=256):
+        registry.parse_spec(spec)
+        self.spec = spec
+        self.max_batch_size = max_batch_size
+        self.num_sessions = 0
+        self.num_moves = 0
+        self.think_time = 0.0
+        # one batcher per model, shared by all sessions that use it
+        self._batchers = {}
+
+    def batcher(self, bot):
+        model = getattr(bot, 'model', None)
+        if model is None:
+            return None
+        if id(model) not in self._batchers:
+            self._batchers[id(model)] = InferenceBatcher(model, self.max_batch_size)
+        return self._batchers[id(model)]
+
+    async def handle(self, reader, writer):
+        self.num_sessions += 1
+        session = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    session, response = await self.respond(session, request)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    response = {'error': str(e)}
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.num_sessions -= 1
+            if session is not None and hasattr(session.bot, 'close'):
+                session.bot.close()
+            writer.close()
+
+    async def respond(self, session, request):
+        command = request.get('cmd')
+        if command == 'stats':
+            return session, self.stats()
+        if command == 'new':
+            if session is not None and hasattr(session.bot, 'close'):
+                session.bot.close()
+            color = request.get('color', 'yellow')
+            if color not in ('red', 'yellow'):
+                raise ValueError('unknown color {!r}'.format(color))
+            human = c4types.Player[color]
+            session = Session(registry.create_agent(self.spec), human)
+        elif command == 'move':
+            if session is None:
+                raise ValueError('no game, send {"cmd": "new"} first')
+            column = request.get('column')
+            if session.game.is_over() or session.game.next_player != session.human:
+                raise ValueError('not your turn')
+            # JSON true would otherwise pass as column 1 and 3.0 as column 3
+            if type(column) is not int:
+                raise ValueError('column must be an integer, got {!r}'.format(column))
+            if column not in session.game.legal_moves():
+                raise ValueError('illegal move {!r}'.format(column))
+            session.play(column)
+        else:
+            raise ValueError('unknown command {!r}'.format(command))
+
+        response = {}
+        if not session.game.is_over() and session.game.next_player != session.human:
+            start = time.perf_counter()
+            move = await think(session.bot, session.game, self.batcher(session.bot))
+            elapsed = time.perf_counter() - start
+            session.play(move)
+            self.num_moves += 1
+            self.think_time += elapsed
+            response = {'bot_move': move, 'think_time': elapsed}
+        response.update(session.to_dict())
+        return session, response
+
+    def stats(self):
+        num_batches = sum(batcher.num_batches for batcher in self._batchers.values())
+        num_rows = sum(batcher.num_rows for batcher in self._batchers.values())
+        return {
+            'sessions': self.num_sessions,
+            'moves': self.num_moves,
+            'mean_think_time': self.think_time / max(self.num_moves, 1),
+            'batches': num_batches,
+            'mean_batch_size': num_rows / max(num_batches, 1),
+        }
+
+async def serve(spec, host='127.0.0.1', port=4004, max_batch_size=256):
+    game_server = GameServer(spec, max_batch_size)
+    server = await asyncio.start_server(game_server.handle, host, port)
+    print('serving {} on {}:{}'.format(spec, host, port))
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,113 @@
+import json
+import time
+
+PHASES = ('selection', 'expansion', 'simulation', 'encoding', 'inference', 'backup')
+
+class MoveStats():
+    """Timings and counters of one select_move call.
+
+    The search calls lap(phase) at the end of each phase, which adds the
+    time since the previous lap to that phase. Agents only create a
+    MoveStats when a stats sink is set, and every lap is guarded by a None
+    check, so a search without a sink does no timing at all.
+    """
+    def __init__(self, agent_name, game_state):
+        self.agent = agent_name
+        self.ply = bin(game_state.board.mask).count('1')
+        self.move = None
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.rounds = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.nodes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.root_visits = [0] * 7
+        self.start = time.perf_counter()
+        self.wall_time = 0.0
+        self._last = self.start
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self._last
+        self._last = now
+
+    def record_depth(self, depth):
+        self.total_depth += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def finish(self, move):
+        self.move = move
+        self.wall_time = time.perf_counter() - self.start
+
+    def to_dict(self):
+        return {
+            'agent': self.agent,
+            'ply': self.ply,
+            'move': self.move,
+            'wall_time': self.wall_time,
+            'times': self.times,
+            'rounds': self.rounds,
+            'max_depth': self.max_depth,
+            'mean_depth': self.total_depth / self.rounds if self.rounds else 0.0,
+            'nodes': self.nodes,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'root_visits': self.root_visits,
+        }
+
+class JsonlSink():
+    """Writes one JSON line per move; extra fields are added to every line."""
+    def __init__(self, path, **fields):
+        self.path = path
+        self.fields = fields
+        self._file = open(path, 'a')
+
+    def record(self, stats):
+        line = stats.to_dict()
+        line.update(self.fields)
+        self._file.write(json.dumps(line) + '\n')
+
+    def close(self):
+        self._file.close()
+
+class MemorySink():
+    """Keeps the records in a list, e.g. for interactive use."""
+    def __init__(self):
+        self.records = []
+
+    def record(self, stats):
+        self.records.append(stats.to_dict())
+
+def load(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+def summarize(records):
+    """Aggregates move records, e.g. from load, into a printable report."""
+    if not records:
+        return 'no moves recorded'
+    wall_time = sum(record['wall_time'] for record in records)
+    rounds = sum(record['rounds'] for record in records)
+    depth = sum(record['mean_depth'] * record['rounds'] for record in records)
+    hits = sum(record['cache_hits'] for record in records)
+    lookups = hits + sum(record['cache_misses'] for record in records)
+    lines = [
+        '{} moves, {:.1f} ms/move, {:.0f} rounds/s, {:.0f} nodes/move'.format(
+            len(records), wall_time / len(records) * 1000, rounds / max(wall_time, 1e-9),
+            sum(record['nodes'] for record in records) / len(records)),
+        'depth {:.1f} mean, {} max, cache hit rate {:.1%}'.format(
+            depth / max(rounds, 1), max(record['max_depth'] for record in records),
+            hits / max(lookups, 1)),
+    ]
+    phases = []
+    for phase in PHASES:
+        seconds = sum(record['times'][phase] for record in records)
+        if seconds > 0:
+            phases.append('{} {:.1%}'.format(phase, seconds / max(wall_time, 1e-9)))
+    lines.append('time: ' + ', '.join(phases))
+    return '\n'.join(lines)
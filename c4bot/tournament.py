@@ -0,0 +1,113 @@
+import functools
+import json
+import os
+import random
+
+from c4bot import c4board
+from c4bot import c4types
+from c4bot import elo
+from c4bot.agent.registry import create_agent
+
+# Agents are given as specs, see c4bot.agent.registry.
+
+def round_robin(specs, games_per_pair):
+    pairings = []
+    for i, first in enumerate(specs):
+        for second in specs[i + 1:]:
+            pairings.append((first, second))
+    return schedule(pairings, games_per_pair)
+
+def gauntlet(specs, games_per_pair):
+    """The first spec plays every other one."""
+    return schedule([(specs[0], other) for other in specs[1:]], games_per_pair)
+
+def schedule(pairings, games_per_pair):
+    # colours alternate within a pairing; both games of a colour-swapped
+    # pair share an opening through their round number
+    games = []
+    for first, second in pairings:
+        for round_number in range(games_per_pair):
+            if round_number % 2 == 0:
+                games.append({'red': first, 'yellow': second, 'round': round_number})
+            else:
+                games.append({'red': second, 'yellow': first, 'round': round_number})
+    return games
+
+def game_key(game):
+    return (game['red'], game['yellow'], game['round'])
+
+def play_game(game, opening_plies=2):
+    """Plays one scheduled game and returns it with its result and moves.
+
+    The result is the score of red: 1, 0.5 or 0.
+    """
+    bots = {
+        c4types.Player.red: create_agent(game['red']),
+        c4types.Player.yellow: create_agent(game['yellow']),
+    }
+    rng = random.Random(game['round'] // 2)
+    state = c4board.GameState.new_game()
+    moves = []
+    for _ in range(opening_plies):
+        if state.is_over():
+            break
+        move = rng.choice(state.legal_moves())
+        moves.append(move)
+        state = state.apply_move(move)
+    while not state.is_over():
+        move = bots[state.next_player].select_move(state)
+        moves.append(move)
+        state = state.apply_move(move)
+    for bot in bots.values():
+        if hasattr(bot, 'close'):
+            bot.close()
+
+    result = dict(game)
+    if state.winner() is None:
+        result['result'] = 0.5
+    else:
+        result['result'] = 1.0 if state.winner() == c4types.Player.red else 0.0
+    result['moves'] = moves
+    return result
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def pending_games(games, results):
+    """The scheduled games that have no result yet, e.g. after an interrupted run."""
+    done = {game_key(result) for result in results}
+    return [game for game in games if game_key(game) not in done]
+
+def run(games, path, pool, opening_plies=2):
+    """Plays games on pool and appends every result to path as soon as it is in."""
+    play = functools.partial(play_game, opening_plies=opening_plies)
+    with open(path, 'a') as f:
+        for result in pool.imap_unordered(play, games):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            yield result
+
+def ratings_table(results, prior=2.0):
+    pairwise = [(result['red'], result['yellow'], result['result']) for result in results]
+    ratings = elo.fit_ratings(pairwise, prior=prior)
+    num_games = {name: 0 for name in ratings}
+    scores = {name: 0.0 for name in ratings}
+    for red, yellow, score in pairwise:
+        num_games[red] += 1
+        num_games[yellow] += 1
+        scores[red] += score
+        scores[yellow] += 1 - score
+
+    width = max([len(name) for name in ratings] + [5])
+    lines = ['{:>4}  {:<{width}}  {:>6}  {:>6}  {:>6}  {:>6}'.format(
+        'rank', 'agent', 'elo', '+/-', 'games', 'score', width=width)]
+    ranked = sorted(ratings, key=lambda name: ratings[name][0], reverse=True)
+    for rank, name in enumerate(ranked, 1):
+        rating, error = ratings[name]
+        lines.append('{:>4}  {:<{width}}  {:>6.0f}  {:>6.0f}  {:>6}  {:>6.1%}'.format(
+            rank, name, rating, 1.96 * error, num_games[name], scores[name] / num_games[name],
+            width=width))
+    return '\n'.join(lines)
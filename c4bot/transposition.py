@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+class TranspositionTable():
+    """Bounded map from position hash to search data.
+
+    Holds at most max_entries positions and evicts the least recently used
+    one when full. A table can be shared by several agents of the same kind
+    and kept across select_move calls.
+    """
+    def __init__(self, max_entries=1000000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def report(self):
+        return '{} entries, {} hits, {} misses ({:.1%} hit rate), {} evictions'.format(
+            len(self._entries), self.hits, self.misses, self.hit_rate(), self.evictions)
@@ -0,0 +1,20 @@
+import argparse
+
+from c4bot.numpy_model import export_model
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export a Keras .h5 model for the NumPy engine in c4bot.numpy_model.')
+    parser.add_argument('model', help='Keras model file, e.g. best.h5')
+    parser.add_argument('output', help='weight file to write, e.g. best.npz')
+    parser.add_argument('--no-fuse', action='store_true',
+        help='keep batch normalizations and activations as separate layers')
+    args = parser.parse_args()
+
+    from keras.models import load_model
+    model = load_model(args.model)
+    export_model(model, args.output, fuse=not args.no_fuse)
+    print('Exported {} to {}'.format(args.model, args.output))
+
+if __name__ == '__main__':
+    main()
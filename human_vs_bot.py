@@ -1,24 +1,19 @@
-from keras.models import Model, load_model
+import argparse
 
-from c4bot import agent
-from c4bot import c4board
-from c4bot import c4types
-from c4bot.utils import print_board, print_move
+from c4bot.__main__ import SPEC_HELP, play, spec
+
+# export best.h5 with export_model.py first, so TensorFlow is not needed; the
+# bot searches for up to 2 seconds per move, or until its choice is settled
+DEFAULT_AGENT = 'zero:model=best.npz,time=2'
 
 def main():
-    model = load_model('best.h5')
-    encoder = agent.ZeroEncoder()
-    bot = agent.ZeroAgent(model, encoder)
-    game = c4board.GameState.new_game()
-    while not game.is_over():
-        print(chr(27) + '[2J')
-        print_board(game.board)
-        if game.next_player == c4types.Player.yellow:
-            move = int(input('-- '))
-        else:
-            move = bot.select_move(game)
-        print_move(game.next_player, move)
-        game = game.apply_move(move)
+    # the same game as python -m c4bot play, with a default agent
+    parser = argparse.ArgumentParser(description='Play against a bot.')
+    parser.add_argument('agent', nargs='?', type=spec, default=DEFAULT_AGENT,
+        help=SPEC_HELP + ' (default: %(default)s)')
+    parser.add_argument('--color', choices=['red', 'yellow'], default='yellow',
+        help='your color; red moves first')
+    play(parser.parse_args())
 
 if __name__ == '__main__':
     main()
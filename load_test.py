@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from c4bot import c4board
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+async def request(reader, writer, message):
+    writer.write((json.dumps(message) + '\n').encode('utf-8'))
+    await writer.drain()
+    response = json.loads((await reader.readline()).decode('utf-8'))
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+async def play(host, port, num_games, latencies, seed):
+    # one connection is one session; the client plays random legal moves
+    # and alternates colors between games
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    for game_index in range(num_games):
+        color = 'red' if (seed + game_index) % 2 == 0 else 'yellow'
+        start = time.perf_counter()
+        response = await request(reader, writer, {'cmd': 'new', 'color': color})
+        if 'bot_move' in response:
+            latencies.append(time.perf_counter() - start)
+        while 'winner' not in response:
+            game = c4board.GameState.new_game()
+            for move in response['moves']:
+                game = game.apply_move(move)
+            start = time.perf_counter()
+            response = await request(reader, writer, {
+                'cmd': 'move', 'column': rng.choice(game.legal_moves())})
+            if 'bot_move' in response:
+                latencies.append(time.perf_counter() - start)
+    writer.close()
+
+async def run(args):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        play(args.host, args.port, args.games, latencies, client)
+        for client in range(args.clients)
+    ])
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    stats = await request(reader, writer, {'cmd': 'stats'})
+    writer.close()
+
+    print('{} clients, {} bot moves in {:.1f}s: {:.1f} moves/s'.format(
+        args.clients, len(latencies), elapsed, len(latencies) / elapsed))
+    print('latency p50 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        max(latencies) * 1000))
+    print('server: {} predict batches, {:.1f} rows per batch, {:.0f} ms mean think time'.format(
+        stats['batches'], stats['mean_batch_size'], stats['mean_think_time'] * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Play many concurrent games against python -m c4bot serve '
+                    'and report its throughput and move latency.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4004)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent sessions')
+    parser.add_argument('--games', type=int, default=2, help='games per client')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import multiprocessing
+
+from c4bot import tournament
+from c4bot.agent import registry
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Play a tournament between agents and rate them. Results are '
+                    'appended to a file, so running the same command again resumes it.')
+    parser.add_argument('results', help='JSON lines file with one game per line')
+    parser.add_argument('agents', nargs='*',
+        help="agent specs such as random, 'mcts:rounds=500,temperature=1.5' or "
+             "'zero:model=best.npz,rounds=200'; without any, only the ratings are shown")
+    parser.add_argument('--games', type=int, default=20, help='games per pairing')
+    parser.add_argument('--mode', choices=['round-robin', 'gauntlet'], default='round-robin')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--opening-plies', type=int, default=2,
+        help='random plies played before the agents take over')
+    parser.add_argument('--prior', type=float, default=2.0,
+        help='virtual draws per agent in the rating fit')
+    args = parser.parse_args()
+    for spec in args.agents:
+        try:
+            registry.parse_spec(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    results = tournament.load_results(args.results)
+    if len(args.agents) >= 2:
+        if args.mode == 'gauntlet':
+            games = tournament.gauntlet(args.agents, args.games)
+        else:
+            games = tournament.round_robin(args.agents, args.games)
+        pending = tournament.pending_games(games, results)
+        print('{} games scheduled, {} already played'.format(len(games), len(games) - len(pending)))
+        with multiprocessing.Pool(args.workers) as pool:
+            for result in tournament.run(pending, args.results, pool, args.opening_plies):
+                results.append(result)
+                print('{} - {}: {}'.format(result['red'], result['yellow'], result['result']))
+
+    if results:
+        print(tournament.ratings_table(results, args.prior))
+
+if __name__ == '__main__':
+    main()
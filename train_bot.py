@@ -1,14 +1,28 @@
 import sys
 import os
 import multiprocessing
-import functools
-import itertools
+import queue
+import random
+import shutil
+import time
 
 from c4bot import c4types
 from c4bot import c4board
+from c4bot import elo
+from c4bot import inference
+from c4bot import replay
+from c4bot import telemetry
 from c4bot.agent import zero
 from c4bot.utils import print_board, print_move
 
+REPLAY_DIRECTORY = 'replay'
+# number of most recent positions kept for training
+REPLAY_WINDOW = 200000
+# per-move search statistics of the self-play workers, one file per worker and cycle
+TELEMETRY_DIRECTORY = 'telemetry'
+# random plies played before the agents take over in gating games
+GATING_OPENING_PLIES = 2
+
 def create_new_model():
     encoder = zero.ZeroEncoder()
     board_input = Input(shape=encoder.shape(), name='board_input')
@@ -69,9 +83,8 @@ def simulate_game(red_agent, red_collector, yellow_agent, yellow_collector):
         yellow_collector.complete_episode(0)
     # print_board(game_state.board)
 
-def gain_experience(worker_id, num_games, rounds_per_move):
-    print('Worker {} started...'.format(worker_id))
-
+def load_models():
+    # runs in the inference server, the only process that imports TensorFlow
     import keras.backend as K
     import tensorflow as tf
     K.set_session(tf.Session())
@@ -91,13 +104,30 @@ def gain_experience(worker_id, num_games, rounds_per_move):
     except OSError:
         best_model = create_new_model()
 
+    return {'latest': latest_model, 'best': best_model}
+
+def gain_experience(worker_id, num_games, rounds_per_move, telemetry_path=None):
+    print('Worker {} started...'.format(worker_id))
+
+    latest_model = inference.remote_model('latest')
+    best_model = inference.remote_model('best')
+
     encoder = zero.ZeroEncoder()
-    red_agent = zero.ZeroAgent(latest_model, encoder, rounds_per_move=rounds_per_move, c=2.0)
-    yellow_agent = zero.ZeroAgent(best_model, encoder, rounds_per_move=rounds_per_move, c=2.0)
-    collector1 = zero.ZeroExperienceCollector()
-    collector2 = zero.ZeroExperienceCollector()
+    red_agent = zero.ZeroAgent(latest_model, encoder, rounds_per_move=rounds_per_move, c=2.0,
+        reuse_tree=True)
+    yellow_agent = zero.ZeroAgent(best_model, encoder, rounds_per_move=rounds_per_move, c=2.0,
+        reuse_tree=True)
+    # finished episodes go straight to disk instead of back through the pool
+    writer = replay.ShardWriter(REPLAY_DIRECTORY, 'worker{}'.format(worker_id))
+    collector1 = replay.ReplayCollector(writer)
+    collector2 = replay.ReplayCollector(writer)
     red_agent.set_collector(collector1)
     yellow_agent.set_collector(collector2)
+    sink = None
+    if telemetry_path is not None:
+        sink = telemetry.JsonlSink(telemetry_path, worker=worker_id)
+        red_agent.set_stats_sink(sink)
+        yellow_agent.set_stats_sink(sink)
 
     old_percent = 100
     for i in range(num_games):
@@ -107,39 +137,93 @@ def gain_experience(worker_id, num_games, rounds_per_move):
         old_percent = percent
         simulate_game(red_agent, collector1, yellow_agent, collector2)
 
-    experience = [collector1, collector2]
-    return experience
+    writer.close()
+    if sink is not None:
+        sink.close()
+    return collector1.num_positions + collector2.num_positions
 
-def evaluate_model(latest_model, best_model, num_games, rounds_per_move):
+def play_gating_game(game_index, rounds_per_move):
+    # latest plays red in even games and yellow in odd ones; both games of a
+    # pair start from the same random opening, since the agents themselves
+    # are deterministic and would otherwise replay one game over and over
+    latest_player = c4types.Player.red if game_index % 2 == 0 else c4types.Player.yellow
     encoder = zero.ZeroEncoder()
     bots = {
-        c4types.Player.red: zero.ZeroAgent(latest_model, encoder, rounds_per_move=rounds_per_move),
-        c4types.Player.yellow: zero.ZeroAgent(best_model, encoder, rounds_per_move=rounds_per_move),
+        latest_player: zero.ZeroAgent(inference.remote_model('latest'), encoder,
+            rounds_per_move=rounds_per_move, reuse_tree=True),
+        latest_player.other: zero.ZeroAgent(inference.remote_model('best'), encoder,
+            rounds_per_move=rounds_per_move, reuse_tree=True),
     }
-    wins = {
-        c4types.Player.red: 0,
-        c4types.Player.yellow: 0,
-    }
-    
-    old_percent = 100
-    for i in range(num_games):
-        percent = int(i / num_games * 100)
-        if percent % 10 == 0 and not percent == old_percent:
-            print('{}%'.format(percent))
-        old_percent = percent
-        game = c4board.GameState.new_game()
-        while not game.is_over():
-            bot_move = bots[game.next_player].select_move(game)
-            game = game.apply_move(bot_move)
-        if game.board.is_winning_move(game.last_move):
-            wins[game.next_player.other] += 1
+    rng = random.Random(game_index // 2)
+    game = c4board.GameState.new_game()
+    for _ in range(GATING_OPENING_PLIES):
+        game = game.apply_move(rng.choice(game.legal_moves()))
+    while not game.is_over():
+        bot_move = bots[game.next_player].select_move(game)
+        game = game.apply_move(bot_move)
+    if game.winner() is None:
+        return 0.5
+    return 1.0 if game.winner() == latest_player else 0.0
 
-    print('Wins red (latest): {}%'.format(wins[c4types.Player.red] / num_games * 100))
-    print('Wins yellow (best): {}%'.format(wins[c4types.Player.yellow] / num_games * 100))
+def evaluate_model(max_games, rounds_per_move):
+    """Plays latest against best until the SPRT decides, at most max_games games.
 
-    return wins[c4types.Player.red] / num_games
+    Returns True if latest should replace best.
+    """
+    sprt = elo.SPRT()
+    start = time.time()
+    server = inference.InferenceServer(load_models, num_slots=os.cpu_count())
+    server.start()
+    num_workers = os.cpu_count()
+    with multiprocessing.Pool(num_workers, inference.connect, (server.connection,)) as p:
+        # at most one game per worker is in flight, so once the test has
+        # decided no new games are handed out and the pool can drain;
+        # terminating workers mid put could corrupt the server's queue
+        finished_games = queue.Queue()
+        def submit(game_index):
+            p.apply_async(play_gating_game, (game_index, rounds_per_move),
+                callback=lambda score: finished_games.put((game_index, score, None)),
+                error_callback=lambda error: finished_games.put((game_index, None, error)))
+        num_running = min(num_workers, max_games)
+        for game_index in range(num_running):
+            submit(game_index)
+        next_game = num_running
+        # a worker gets a new game as soon as it finishes one, but scores are
+        # recorded in game order, so short decisive games do not bias the test
+        scores = {}
+        next_recorded = 0
+        while num_running:
+            game_index, score, error = finished_games.get()
+            num_running -= 1
+            if error is not None:
+                raise error
+            scores[game_index] = score
+            while next_recorded in scores and sprt.status() is None:
+                sprt.record(scores.pop(next_recorded))
+                next_recorded += 1
+            if sprt.status() is None and next_game < max_games:
+                submit(next_game)
+                next_game += 1
+                num_running += 1
+        p.close()
+        p.join()
+    server.stop()
+    elapsed = time.time() - start
+
+    status = sprt.status()
+    print('Gating: ' + sprt.report())
+    if status is None:
+        # undecided after max_games, fall back to a fixed score threshold
+        promote = sprt.score() > 0.55
+        print('Gating undecided after {} games, score {:.1%}'.format(sprt.num_games, sprt.score()))
+    else:
+        promote = status == elo.ACCEPT
+        saved = elapsed / sprt.num_games * (max_games - sprt.num_games)
+        print('Gating {}ed after {} of {} games in {:.0f}s, about {:.0f}s saved'.format(
+            status, sprt.num_games, max_games, elapsed, saved))
+    return promote
 
-def train_and_evaluate(experience, num_games, rounds_per_move):
+def train_model():
     import keras.backend as K
     import tensorflow as tf
     K.set_session(tf.Session())
@@ -155,42 +239,47 @@ def train_and_evaluate(experience, num_games, rounds_per_move):
     except OSError:
         latest_model = create_new_model()
 
+    experience = replay.ReplayBuffer(REPLAY_DIRECTORY, REPLAY_WINDOW)
+    print('Replay window: {} positions in {} shards'.format(len(experience), len(experience.shards)))
     encoder = zero.ZeroEncoder()
     agent = zero.ZeroAgent(latest_model, encoder)
-    agent.train(experience, 0.01, 2048)
+    agent.train(experience, 0.01, 2048, augment=True)
     latest_model.save('latest.h5')
 
-    print('Evaluating model...')
-    try:
-        best_model = load_model('best.h5')
-    except OSError:
-        best_model = create_new_model()
-
-    if evaluate_model(latest_model, best_model, num_games, rounds_per_move) > 0.55:
-        print('Replacing best model? YES!')
-        latest_model.save('best.h5')
-    else:
-        print('Replacing best model? NO!')
-
-def get_collector(result):
-    return result.get()
-
 # MAIN
 cycle = 1
 while True:
     print('Training cycle {}:'.format(cycle))
 
     print('Collecting experience...')
-    with multiprocessing.Pool(None) as p:
-        results = [p.apply_async(gain_experience, (i, 20, 16)) for i in range(os.cpu_count())]
+    server = inference.InferenceServer(load_models, num_slots=os.cpu_count())
+    server.start()
+    os.makedirs(TELEMETRY_DIRECTORY, exist_ok=True)
+    telemetry_paths = [
+        os.path.join(TELEMETRY_DIRECTORY, 'cycle{}-worker{}.jsonl'.format(cycle, i))
+        for i in range(os.cpu_count())
+    ]
+    with multiprocessing.Pool(None, inference.connect, (server.connection,)) as p:
+        results = [
+            p.apply_async(gain_experience, (i, 20, 16, telemetry_paths[i]))
+            for i in range(os.cpu_count())
+        ]
         p.close()
         p.join()
-    collectors = [get_collector(result) for result in results]
-    flattened_collectors = list(itertools.chain.from_iterable(collectors))
-    experience = zero.ZeroExperienceBuffer.combine_experience(flattened_collectors)
+    server.stop()
+    num_positions = sum(result.get() for result in results)
+    print('Recorded {} positions'.format(num_positions))
+    print(telemetry.summarize(telemetry.load(telemetry_paths)))
 
-    p = multiprocessing.Process(target=train_and_evaluate, args=(experience, 100, 16))
+    p = multiprocessing.Process(target=train_model)
     p.start()
     p.join()
-        
+
+    print('Evaluating model...')
+    if evaluate_model(100, 16):
+        print('Replacing best model? YES!')
+        shutil.copyfile('latest.h5', 'best.h5')
+    else:
+        print('Replacing best model? NO!')
+
     cycle += 1